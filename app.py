@@ -1,18 +1,39 @@
 import streamlit as st
-import pandas as pd
-import io
 import os
-import json
-import openai
+import sys
+import time
+import logging
 from datetime import datetime, timedelta
 
-# 1) Import the updated functions from chunked_embeddings
-from chunked_embeddings import (
-    split_text,
-    create_embeddings_for_chunks,
-    find_top_n_chunks,
-    ask_gpt
-)
+# pandas, numpy, openai and the modules built on them are imported inside the
+# functions / branches that use them, so the first page renders before they load.
+from conversation_store import ConversationStore, DEFAULT_PAGE_SIZE, DEFAULT_WINDOW, session_db_path
+from kb_loader import KNOWLEDGE_BASE_PATH, DEFAULT_CHUNK_TOKENS
+
+# Pipeline timings (e.g. GPT time-to-first-token) are reported through logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+logger = logging.getLogger("app")
+
+# Token limit per knowledge-base chunk (sections larger than this are split)
+CHUNK_MAX_TOKENS = DEFAULT_CHUNK_TOKENS
+
+# ------------------------------------------
+# Startup profiling: APP_PROFILE_STARTUP=1 (or ?profile=1 in the URL) records
+# the time to each checkpoint of this run and shows it at the bottom of the page.
+# ------------------------------------------
+PROFILE_STARTUP = os.environ.get("APP_PROFILE_STARTUP") == "1" or st.query_params.get("profile") == "1"
+# Admin panel with per-stage latency percentiles (APP_ADMIN=1 or ?admin=1)
+ADMIN_PANEL = os.environ.get("APP_ADMIN") == "1" or st.query_params.get("admin") == "1"
+RUN_STARTED = time.perf_counter()
+RUN_TIMINGS = []
+
+def mark_timing(label):
+    RUN_TIMINGS.append((label, time.perf_counter() - RUN_STARTED))
+
+@st.cache_resource
+def get_process_state():
+    # Lives as long as the server process: tells the first (cold) run from later reruns
+    return {"runs": 0, "query_cache_ready": False}
 
 # ------------------------------------------
 # Set page config to wide layout
@@ -56,139 +77,237 @@ div[data-testid="column"]:nth-of-type(2) {
 # ------------------------------------------
 # Session State Initialization
 # ------------------------------------------
+# The conversation keeps the last CONVERSATION_WINDOW messages in memory and a summary of
+# the rest; set CONVERSATION_DB_DIR to also keep each session's full history in a SQLite file
+# (the ?session=<id> URL parameter then resumes it after a reload or server restart).
+CONVERSATION_DB_DIR = os.environ.get("CONVERSATION_DB_DIR")
+
+def new_conversation():
+    return ConversationStore(
+        window=int(os.environ.get("CONVERSATION_WINDOW", DEFAULT_WINDOW)),
+        db_path=session_db_path(CONVERSATION_DB_DIR, st.session_state.session_id) if CONVERSATION_DB_DIR else None
+    )
+
+if 'session_id' not in st.session_state:
+    import re
+    import uuid
+    requested = st.query_params.get("session", "")
+    st.session_state.session_id = requested if CONVERSATION_DB_DIR and re.fullmatch(r"[0-9a-f]{32}", requested) \
+        else uuid.uuid4().hex
+    if CONVERSATION_DB_DIR:
+        st.query_params["session"] = st.session_state.session_id
 if 'conversation' not in st.session_state:
-    st.session_state.conversation = [
-        {
-            "role": "system",
-            "content": (
-                "You are an AI assistant that ONLY answers based on the provided knowledge base. "
-                "If the answer is not in the knowledge base, reply with: 'I don't have information on that.'"
-            )
-        }
-    ]
+    st.session_state.conversation = new_conversation()
+# Cleaned timecards are kept per user as Parquet when TIMECARD_STORE_DIR is set and the
+# user is signed in (st.login); a weekly re-upload then only appends the new Timecard Index
+# rows. Anonymous sessions are not stored: a new session could never find them again.
+TIMECARD_STORE_DIR = os.environ.get("TIMECARD_STORE_DIR")
+
+def current_user_id():
+    # The signed-in user's e-mail, or None without authentication
+    if st.user.get("is_logged_in") and st.user.get("email"):
+        return st.user.get("email")
+    return None
+
+@st.cache_resource(max_entries=256)
+def get_timecard_store(user_id):
+    from timecard_store import TimecardStore
+    return TimecardStore(user_id, store_dir=TIMECARD_STORE_DIR)
+
 if 'df_cleaned' not in st.session_state:
     st.session_state.df_cleaned = None
+if 'timecard_analytics' not in st.session_state:
+    st.session_state.timecard_analytics = None
+    st.session_state.analytics_file_digest = None
 
 # ------------------------------------------
-# Securely Get API Key
+# Securely Get API Key (set right before the first OpenAI call)
+# The backend and its pooled HTTP connections are configured once per process
+# and shared by all sessions.
 # ------------------------------------------
-openai.api_key = st.secrets["OPENAI_API_KEY"]
+@st.cache_resource
+def configure_openai():
+    # LLM_BACKEND=fake runs the app offline (see llm_backend.py); it needs no key
+    from llm_backend import get_backend
+    backend = get_backend()
+    if backend.requires_api_key:
+        import openai
+        openai.api_key = st.secrets["OPENAI_API_KEY"]
+    return backend
 
 # ------------------------------------------
 # Load Knowledge Base from JSON
+# Each version of knowledge_base.json is parsed, chunked and indexed into one bundle
+# (see index_knowledge_base), served by the watcher below. A run reads the current
+# version once and answers from that bundle only.
 # ------------------------------------------
-def load_knowledge_base():
-    try:
-        with open("knowledge_base.json", "r", encoding="utf-8") as file:
-            return json.load(file)
-    except FileNotFoundError:
-        st.error("Knowledge base file not found! Make sure 'knowledge_base.json' is in the project folder.")
-        return {}
-
-knowledge_base = load_knowledge_base()
+def index_knowledge_base(knowledge_base):
+    """
+    Everything one version of the knowledge base serves: the parsed dict, the business
+    calendar, the section-sized chunks and the BM25, FAQ and embedding indexes over them
+    (the indexes are None when there are no chunks).
+    """
+    from business_calendar import BusinessCalendar
+    from kb_loader import chunk_knowledge_base
+    bundle = {
+        "knowledge_base": knowledge_base,
+        # Business days for projections: weekdays minus firm holidays
+        "calendar": BusinessCalendar.from_knowledge_base(knowledge_base),
+        "chunks": tuple(chunk["text"] for chunk in chunk_knowledge_base(knowledge_base, max_tokens=CHUNK_MAX_TOKENS)),
+        "lexical_index": None,
+        "faq_index": None,
+        "retriever": None,
+    }
+    if not bundle["chunks"]:
+        return bundle
+    configure_openai()
+
+    # BM25 index over the chunks (fused with the embedding ranking, or used alone
+    # when it is confident enough)
+    from lexical_index import BM25Index
+    bundle["lexical_index"] = BM25Index(bundle["chunks"])
+
+    # Curated Q&A answers and confidentiality responses served without GPT
+    # when a question matches closely enough (threshold: FAQ_MATCH_THRESHOLD)
+    from kb_loader import faq_entries
+    from faq_index import DEFAULT_FAQ_THRESHOLD, build_faq_index
+    threshold = float(os.environ.get("FAQ_MATCH_THRESHOLD", DEFAULT_FAQ_THRESHOLD))
+    bundle["faq_index"] = build_faq_index(faq_entries(knowledge_base), threshold=threshold)
+
+    # Persistent embedding index: only chunks that are not already on disk get embedded.
+    # The matrix is memory-mapped read-only: sessions share one retriever and
+    # worker processes share the file's pages.
+    from embedding_store import build_store
+    store = build_store(list(bundle["chunks"]), chunk_size=CHUNK_MAX_TOKENS, mmap=True)
+    logger.info("embedding index: %d chunks (%d embedded)", len(store.chunks), store.last_embedded_count)
+    bundle["retriever"] = store.retriever()
+    return bundle
+
+def build_knowledge_base(data):
+    # Runs on the watcher thread; invalid JSON raises, so that version is not served
+    from kb_loader import parse_knowledge_base
+    return index_knowledge_base(parse_knowledge_base(data))
 
 # ------------------------------------------
-# Convert the entire knowledge_base into one big text
+# Hot reload: when knowledge_base.json changes, a background thread builds the
+# new version's bundle (embedding only new or changed chunks), then every session
+# switches to it at its next rerun. Sessions keep serving the previous version
+# meanwhile. KB_WATCH_INTERVAL: seconds between checks (0 = off, every rerun then
+# rebuilds synchronously after a change).
 # ------------------------------------------
-def convert_json_to_text(data):
-    text_fragments = []
-    def traverse(obj):
-        if isinstance(obj, dict):
-            for k, v in obj.items():
-                if k.lower() in ["answer", "content"]:
-                    if isinstance(v, str):
-                        text_fragments.append(v)
-                else:
-                    traverse(v)
-        elif isinstance(obj, list):
-            for item in obj:
-                traverse(item)
-    traverse(data)
-    return "\n".join(text_fragments)
-
-big_knowledge_text = convert_json_to_text(knowledge_base)
+KB_WATCH_INTERVAL = float(os.environ.get("KB_WATCH_INTERVAL", "2"))
+
+@st.cache_resource(show_spinner="Indexing knowledge base...")
+def get_kb_watcher():
+    from kb_watcher import KnowledgeBaseWatcher
+    watcher = KnowledgeBaseWatcher(KNOWLEDGE_BASE_PATH, build_knowledge_base, interval=KB_WATCH_INTERVAL)
+    watcher.reload()  # the first version is built before anything is served
+    return watcher.start() if KB_WATCH_INTERVAL > 0 else watcher
+
+if KB_WATCH_INTERVAL <= 0:
+    get_kb_watcher().reload()
+knowledge_base_index = get_kb_watcher().current()
+if knowledge_base_index is not None:
+    knowledge_base_bundle = knowledge_base_index.value
+else:
+    if get_kb_watcher().last_error:
+        st.error(f"Knowledge base could not be loaded: {get_kb_watcher().last_error}")
+    else:
+        st.error("Knowledge base file not found! Make sure 'knowledge_base.json' is in the project folder.")
+    knowledge_base_bundle = index_knowledge_base({})
+knowledge_base = knowledge_base_bundle["knowledge_base"]
+mark_timing("knowledge base loaded")
 
 # ------------------------------------------
-# Our chunk-based "find_best_answer" function (top 2 chunks)
+# Query embedding / answer cache shared across all sessions
+# Set QUERY_CACHE_PATH to a SQLite file to keep it across restarts.
 # ------------------------------------------
-def find_best_answer_chunked(user_query, knowledge_text):
-    if not knowledge_text.strip():
-        return "I don't have information on that."
-    chunks = split_text(knowledge_text, chunk_size=300, overlap=50)
-    embeddings = create_embeddings_for_chunks(chunks)
-    top_chunks = find_top_n_chunks(user_query, embeddings, n=2)
-    combined_chunks = "\n\n".join(f"[Score: {score:.3f}] {chunk}" for score, chunk in top_chunks)
-    answer = ask_gpt(user_query, combined_chunks)
-    return answer
+@st.cache_resource
+def get_query_cache():
+    from chunked_embeddings import QueryCache
+    get_process_state()["query_cache_ready"] = True
+    return QueryCache(disk_path=os.environ.get("QUERY_CACHE_PATH"))
 
 # ------------------------------------------
-# Projection Calculation Logic
+# Our chunk-based "find_best_answer" function
+# The top PROMPT_CANDIDATES chunks are packed into a PROMPT_CONTEXT_TOKENS budget
+# (see prompt_builder.build_context).
 # ------------------------------------------
-def calculate_required_days(current_weighted_date_diff, current_hours_worked, user_promised_hours, user_delay):
-    current_average = current_weighted_date_diff / current_hours_worked if current_hours_worked else 0
-    required_days = max(
-        0,
-        (4.99 * current_hours_worked - current_weighted_date_diff)
-        / (user_promised_hours * user_delay - 4.99 * user_promised_hours)
-    )
-    required_days = round(required_days)
-    projected_hours_worked = current_hours_worked + (user_promised_hours * required_days)
-    projected_weighted_date_diff = current_weighted_date_diff + (user_promised_hours * user_delay * required_days)
-    projected_average = (
-        projected_weighted_date_diff / projected_hours_worked if projected_hours_worked else 0
-    )
-    return {
-        'Current Average': current_average,
-        'Projected Average': projected_average,
-        'Required Days': required_days
-    }
-
-def get_upcoming_reset_date(title, current_date):
+PROMPT_CANDIDATES = 3
+def find_best_answer_chunked(user_query, bundle, stream=False):
     """
-    If title is 'Associate' or 'Staff Attorney' (case-insensitive),
-    reset is November 1. Otherwise, October 1.
+    Answers a general question from the best chunks of 'bundle' (the served knowledge-base
+    version, see index_knowledge_base) that fit the prompt budget.
+    With stream=True, returns an iterator of text pieces instead of the full answer;
+    the complete answer is cached once the stream is exhausted.
     """
-    title_lower = title.lower()
-    if "associate" in title_lower or "staff attorney" in title_lower:
-        reset_month, reset_day = 11, 1
-    else:
-        reset_month, reset_day = 10, 1
+    from chunked_embeddings import find_top_n_chunks, lexical_fast_path, ask_gpt, ask_gpt_stream
+    from faq_index import format_faq_answer
+    from prompt_builder import DEFAULT_CONTEXT_TOKENS, build_context
+
+    if not bundle["chunks"]:
+        answer = "I don't have information on that."
+        return iter([answer]) if stream else answer
+    configure_openai()
+    query_cache = get_query_cache()
+
+    # A close match to a curated question is answered directly (no GPT call).
+    # When retrieval will take the lexical fast path, the FAQ must not embed the query either.
+    lexical_index = bundle["lexical_index"]
+    embed_fn = None if lexical_fast_path(user_query, lexical_index, n=PROMPT_CANDIDATES) else query_cache.get_embedding
+    faq_index = bundle["faq_index"]
+    match = faq_index.match(user_query, embed_fn)
+    faq_stats = faq_index.stats()
+    if match is not None:
+        entry, similarity = match
+        logger.info(
+            "faq short-circuit: %s answer (similarity=%.3f); served %d/%d queries (%.0f%%)",
+            entry["kind"], similarity, faq_stats["served"], faq_stats["total"], faq_stats["served_rate"] * 100
+        )
+        disclaimer = bundle["knowledge_base"].get("disclaimers", {}).get("primary_disclaimer", "")
+        answer = format_faq_answer(entry, disclaimer)
+        return iter([answer]) if stream else answer
+
+    top_chunks = find_top_n_chunks(
+        user_query, bundle["retriever"], n=PROMPT_CANDIDATES, cache=query_cache, lexical_index=lexical_index
+    )
+    chunk_texts = [chunk for _, chunk in top_chunks]
+    combined_chunks, context_stats = build_context(
+        top_chunks, max_tokens=int(os.environ.get("PROMPT_CONTEXT_TOKENS", DEFAULT_CONTEXT_TOKENS))
+    )
+    logger.info(
+        "prompt context: %d tokens from %d chunks (%d duplicate lines / sentences, %d overlap words, %d left out for budget)",
+        context_stats["tokens"], context_stats["chunks"], context_stats["duplicate_units"],
+        context_stats["overlap_words"], context_stats["units_dropped"]
+    )
 
-    year = current_date.year
-    candidate = datetime(year, reset_month, reset_day).date()
-    if current_date <= candidate:
-        return candidate
-    else:
-        return datetime(year + 1, reset_month, reset_day).date()
-
-# Helper to skip weekends if needed
-def add_business_days(start_date, days_needed):
-    current = start_date
-    business_days_passed = 0
-    while business_days_passed < days_needed:
-        current += timedelta(days=1)
-        # Monday=0 ... Sunday=6
-        if current.weekday() < 5:  # It's a weekday
-            business_days_passed += 1
-    return current
+    cached = query_cache.lookup_answer(user_query, chunk_texts)
+    if cached is not None:
+        return iter([cached]) if stream else cached
+    if not stream:
+        answer = ask_gpt(user_query, combined_chunks)
+        query_cache.store_answer(user_query, chunk_texts, answer)
+        return answer
+
+    def stream_and_cache():
+        pieces = []
+        for piece in ask_gpt_stream(user_query, combined_chunks):
+            pieces.append(piece)
+            yield piece
+        query_cache.store_answer(user_query, chunk_texts, "".join(pieces))
+    return stream_and_cache()
 
 # ------------------------------------------
-# Function to answer Excel analysis questions based on cleaned DataFrame
+# Function to answer Excel analysis questions based on the cleaned upload
+# (aggregates are built once per upload in TimecardAnalytics)
 # ------------------------------------------
-def answer_excel_question(user_query, df):
-    # Make a copy of the DataFrame to avoid modifying the original
-    df = df.copy()
-    # Ensure relevant numeric columns are converted
-    for col in ["Weighted Date Diff", "Days To Enter Time", "Hours Worked"]:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
-    
-    query_lower = user_query.lower()
-    response = (
-        "I'm sorry, I couldn't parse your Excel query. "
-        "Please try rephrasing your question regarding the Excel records."
-    )
-    return response
+def answer_excel_question(user_query, analytics):
+    if analytics is None:
+        return (
+            "I'm sorry, I couldn't parse your Excel query. "
+            "Please try rephrasing your question regarding the Excel records."
+        )
+    return analytics.answer(user_query)
 
 # ------------------------------------------
 # Logo at Top-Left
@@ -201,6 +320,7 @@ st.markdown(
     """,
     unsafe_allow_html=True
 )
+mark_timing("header rendered")
 
 # ------------------------------------------
 # Create two columns
@@ -213,6 +333,15 @@ col1, col2 = st.columns([1.2, 3], gap="medium")
 with col1:
     st.title("Average Days to Enter Time - AI Assistant")
     user_input = st.text_input("Ask me anything about Average Days to Enter Time:")
+    if knowledge_base_index is not None:
+        built = datetime.fromtimestamp(knowledge_base_index.built_at).strftime('%m/%d/%Y %H:%M:%S')
+        st.caption(
+            f"Knowledge base version {knowledge_base_index.number}, "
+            f"built {built} in {knowledge_base_index.build_seconds:.2f} s"
+        )
+        if ADMIN_PANEL and get_kb_watcher().last_error:
+            st.caption(f"Latest knowledge base edit not loaded: {get_kb_watcher().last_error}")
+    mark_timing("first paint")
 
 # ------------------------------------------
 # RIGHT COLUMN (Excel/Projection, Answers)
@@ -233,6 +362,14 @@ with col2:
         "average days to enter time",
         "my average days to enter time"
     ]
+    # Trigger phrases for team-wide (bulk) projections
+    team_projection_triggers = [
+        "team projection",
+        "bulk projection",
+        "project my team",
+        "projection for my team",
+        "all timekeepers"
+    ]
     # Define keywords to detect Excel analysis questions
     excel_analysis_keywords = [
         "record", "weighted", "timecard", "delay", "entry",
@@ -240,48 +377,114 @@ with col2:
     ]
 
     if user_input:
-        st.session_state.conversation.append({"role": "user", "content": user_input})
+        st.session_state.conversation.append("user", user_input)
+        answer_rendered = False
         
+        # Team-wide projection over one or more exports
+        if any(trigger in user_input.lower() for trigger in team_projection_triggers):
+            uploaded_files = st.file_uploader(
+                "Upload one or more Excel exports", type=["xlsx"], accept_multiple_files=True
+            )
+            if uploaded_files:
+                import pandas as pd
+                from excel_ingest import TIMECARD_COLUMNS, load_timecards, read_header
+                from projection import project_team
+
+                file_contents = [f.getvalue() for f in uploaded_files]
+                header_columns = [c for c in read_header(file_contents[0]) if isinstance(c, str)]
+                timekeeper_column = st.selectbox("Timekeeper column:", header_columns)
+                title_column = st.selectbox("Title column (optional):", ["(none)"] + header_columns)
+                title_column = None if title_column == "(none)" else title_column
+                default_title = st.selectbox(
+                    "Title for timekeepers without a title column:",
+                    ["Associate", "Staff Attorney", "Partner", "Counsel", "Other"]
+                )
+                team_delay = st.number_input("Entry delay (days):", min_value=0.0, value=1.0, step=0.1)
+                team_hours = st.number_input("Hours entered per session:", min_value=0.0, value=7.5, step=0.5)
+                team_weekends = st.selectbox(
+                    "Working days:", ["Weekdays only", "Weekdays + weekends"], key="team_weekend_option"
+                )
+
+                if st.button("Run Team Projection"):
+                    columns = TIMECARD_COLUMNS + [c for c in (timekeeper_column, title_column) if c]
+                    team_df = pd.concat(
+                        [load_timecards(data, columns=columns) for data in file_contents],
+                        ignore_index=True
+                    )
+                    team_results = project_team(
+                        team_df, timekeeper_column, team_hours, team_delay,
+                        title_column=title_column, default_title=default_title,
+                        weekdays_only=team_weekends == "Weekdays only",
+                        calendar=knowledge_base_bundle["calendar"]
+                    )
+                    st.markdown(f"**Team projection for {len(team_results)} timekeepers ({len(team_df)} timecard rows):**")
+                    st.dataframe(team_results, use_container_width=True)
+                    st.download_button(
+                        label="Download Team Projection (CSV)",
+                        data=team_results.to_csv(index=False),
+                        file_name="team_projection.csv",
+                        mime="text/csv"
+                    )
+            else:
+                st.warning("Please upload one or more Excel exports to run a team projection.")
+
         # Check for projection-related queries
-        if any(trigger in user_input.lower() for trigger in projection_triggers) or (
+        elif any(trigger in user_input.lower() for trigger in projection_triggers) or (
             "average" in user_input.lower() and 
             ("calculate" in user_input.lower() or "project" in user_input.lower() or "lower" in user_input.lower())
         ):
             # Excel upload
             uploaded_file = st.file_uploader("Upload an Excel file", type=["xlsx"])
             df_cleaned = None
+            cleaned_totals = None
             
             if uploaded_file:
-                df = pd.read_excel(uploaded_file, engine='openpyxl')
-                st.write("### Preview of Uploaded Data:", df.head())
-                
-                # Basic cleaning approach
-                df_cleaned = df.iloc[2:].reset_index(drop=True)
-                df_cleaned.columns = df_cleaned.iloc[0]
-                df_cleaned = df_cleaned[1:].reset_index(drop=True)
-                df_cleaned = df_cleaned.dropna(axis=1, how='all')
-                df_cleaned = df_cleaned.loc[:, ~df_cleaned.columns.astype(str).str.contains('Unnamed', na=False)]
-                df_cleaned.dropna(how='all', inplace=True)
+                import numpy as np
+                import pandas as pd
+                from excel_ingest import file_digest, load_timecards, read_preview
+                from excel_analytics import TimecardAnalytics
+                from timecard_store import export_xlsx
+                from projection import (
+                    calculate_required_days,
+                    get_upcoming_reset_date,
+                    add_business_days,
+                    projection_grid,
+                    max_delay_for_deadline
+                )
+
+                file_bytes = uploaded_file.getvalue()
+                st.write("### Preview of Uploaded Data:", read_preview(file_bytes))
                 
-                # Attempt to remove trailing rows
-                if "Weighted Date Diff" in df_cleaned.columns:
-                    try:
-                        last_valid_index = df_cleaned[df_cleaned["Weighted Date Diff"].notna()].index[-1]
-                        df_cleaned = df_cleaned.iloc[:last_valid_index - 1]
-                    except Exception:
-                        pass
+                # Parsed + cleaned once per file (cached by file hash across reruns); with the
+                # per-user store, only rows not stored yet are written and the totals kept current
+                user_id = current_user_id() if TIMECARD_STORE_DIR else None
+                if user_id:
+                    timecard_store = get_timecard_store(user_id)
+                    df_cleaned, store_stats = timecard_store.ingest(file_bytes)
+                    cleaned_totals = timecard_store.totals
+                    if not store_stats["from_store"]:
+                        st.caption(
+                            f"Saved timecards: {timecard_store.rows} rows ({store_stats['new_rows']} new, "
+                            f"{store_stats['updated_rows']} revised, {store_stats['removed_rows']} no longer in the export)."
+                        )
+                else:
+                    df_cleaned = load_timecards(file_bytes)
+                    # Sums accumulated while the sheet was streamed
+                    cleaned_totals = df_cleaned.attrs.get("totals")
                 
                 st.write("### Preview of Cleaned Data:", df_cleaned.head())
                 st.session_state.df_cleaned = df_cleaned
                 
-                # Download the cleaned file
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df_cleaned.to_excel(writer, index=False, sheet_name="Cleaned Data")
-                output.seek(0)
+                # Build the Excel Q&A aggregates once per uploaded file
+                digest = file_digest(file_bytes)
+                if st.session_state.analytics_file_digest != digest:
+                    st.session_state.timecard_analytics = TimecardAnalytics(df_cleaned)
+                    st.session_state.analytics_file_digest = digest
+                
+                # Download the cleaned file (the workbook is only written when the button is clicked)
                 st.download_button(
                     label="Download Cleaned Excel",
-                    data=output,
+                    data=lambda: export_xlsx(df_cleaned),
                     file_name="cleaned_data.xlsx",
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 )
@@ -331,6 +534,13 @@ with col2:
 
                 if st.button("Calculate Projection"):
                     if (
+                        cleaned_totals is not None
+                        and "Weighted Date Diff" in cleaned_totals
+                        and cleaned_totals.get("Hours Worked")
+                    ):
+                        current_weighted_date_diff = cleaned_totals["Weighted Date Diff"]
+                        current_hours_worked = cleaned_totals["Hours Worked"]
+                    elif (
                         df_cleaned is not None 
                         and "Weighted Date Diff" in df_cleaned.columns 
                         and "Hours Worked" in df_cleaned.columns
@@ -355,47 +565,101 @@ with col2:
                     )
 
                     required_days = results['Required Days']
-                    if weekend_option == "Weekdays only":
-                        target_date = add_business_days(current_date, required_days)
-                    else:
-                        target_date = current_date + timedelta(days=required_days)
+                    weekdays_only = weekend_option == "Weekdays only"
+                    business_calendar = knowledge_base_bundle["calendar"]
 
                     # Determine upcoming reset date based on the selected title
                     upcoming_reset = get_upcoming_reset_date(title, current_date)
-                    target_date_str = target_date.strftime('%m/%d/%Y')
                     upcoming_reset_str = upcoming_reset.strftime('%m/%d/%Y')
-
                     disclaimer = knowledge_base.get("disclaimers", {}).get("primary_disclaimer", "")
-                    projection_message = (
-                        f"{disclaimer}\n\n"
-                        f"Projection Results:\n"
-                        f"- **Current Average:** {results['Current Average']:.2f} days\n"
-                        f"- **Projected Average:** {results['Projected Average']:.2f} days\n"
-                        f"- **Required Additional Days (Working Days):** {required_days}\n"
-                        f"- **Projected Date to Reach Average Below 5:** {target_date_str}\n"
-                    )
-                    
-                    if target_date > upcoming_reset:
+
+                    if required_days is None:
+                        projection_message = (
+                            f"{disclaimer}\n\n"
+                            f"Projection Results:\n"
+                            f"- **Current Average:** {results['Current Average']:.2f} days\n"
+                            f"\n**Note:** With an entry delay of {entry_delay:.1f} days and {promised_hours:.1f} hours "
+                            "per session, your average cannot drop below 5. "
+                            "Enter time sooner (a delay under 4.99 days) to bring it down."
+                        )
+                    else:
+                        if weekdays_only:
+                            target_date = add_business_days(current_date, required_days, calendar=business_calendar)
+                        else:
+                            target_date = current_date + timedelta(days=required_days)
+                        target_date_str = target_date.strftime('%m/%d/%Y')
+
+                        projection_message = (
+                            f"{disclaimer}\n\n"
+                            f"Projection Results:\n"
+                            f"- **Current Average:** {results['Current Average']:.2f} days\n"
+                            f"- **Projected Average:** {results['Projected Average']:.2f} days\n"
+                            f"- **Required Additional Days (Working Days):** {required_days}\n"
+                            f"- **Projected Date to Reach Average Below 5:** {target_date_str}\n"
+                        )
+                        
+                        if target_date > upcoming_reset:
+                            projection_message += (
+                                f"\n**Note:** With your current working schedule, the projected date "
+                                f"({target_date_str}) falls after your title's reset date "
+                                f"({upcoming_reset_str}). "
+                                "This means the projection may not be achievable as calculated. "
+                                "Consider increasing your entry frequency or hours."
+                            )
+
+                    # Inverse: the entry delay that still gets under 5 before the reset date
+                    needed_delay = float(max_delay_for_deadline(
+                        current_weighted_date_diff, current_hours_worked, promised_hours,
+                        current_date, upcoming_reset, weekdays_only=weekdays_only, calendar=business_calendar
+                    ))
+                    if needed_delay < 0:
+                        projection_message += (
+                            f"\n\n**What it takes:** No working day is left before {upcoming_reset_str}, "
+                            f"so your average stays {-needed_delay:.2f} days above the target."
+                        )
+                    elif np.isnan(needed_delay):
                         projection_message += (
-                            f"\n**Note:** With your current working schedule, the projected date "
-                            f"({target_date_str}) falls after your title's reset date "
-                            f"({upcoming_reset_str}). "
-                            "This means the projection may not be achievable as calculated. "
-                            "Consider increasing your entry frequency or hours."
+                            f"\n\n**What it takes:** Even same-day entry at {promised_hours:.1f} hours per session "
+                            f"will not bring your average below 5 before {upcoming_reset_str}."
+                        )
+                    else:
+                        projection_message += (
+                            f"\n\n**What it takes:** To get below 5 before {upcoming_reset_str} at "
+                            f"{promised_hours:.1f} hours per session, enter time within "
+                            f"{needed_delay:.1f} days of working it."
                         )
                     
-                    st.session_state.conversation.append({"role": "assistant", "content": projection_message})
+                    st.session_state.conversation.append("assistant", projection_message)
                     st.markdown(f"**GPT:** {projection_message}")
 
+                    # What-if grid: every (entry delay, hours per session) pair in one vectorized pass
+                    grid_days, grid_dates = projection_grid(
+                        current_weighted_date_diff, current_hours_worked, current_date,
+                        weekdays_only=weekdays_only, calendar=business_calendar
+                    )
+                    reset_day = np.datetime64(upcoming_reset, "D")
+                    late = grid_dates.apply(lambda col: col.isna() | (col.to_numpy(dtype="datetime64[D]") > reset_day))
+                    st.markdown(
+                        f"**What-if: working days needed to get below 5** "
+                        f"(red = after your reset date {upcoming_reset_str} or not reachable)"
+                    )
+                    st.dataframe(
+                        grid_days.style.apply(
+                            lambda _: np.where(late, "background-color: #8b1a1a", "background-color: #1e6b34"),
+                            axis=None
+                        ),
+                        use_container_width=True
+                    )
+                    with st.expander("Projected dates for each combination", expanded=False):
+                        st.dataframe(grid_dates.apply(lambda col: col.dt.strftime('%m/%d/%Y')), use_container_width=True)
+
                     # Display top 5 records with highest Weighted Date Diff
+                    # (from the per-upload index: no copy or sort of the cleaned frame per click)
+                    timecard_analytics = st.session_state.timecard_analytics
                     if (
-                        st.session_state.df_cleaned is not None 
-                        and "Weighted Date Diff" in st.session_state.df_cleaned.columns
+                        timecard_analytics is not None
+                        and "Weighted Date Diff" in timecard_analytics.frame.columns
                     ):
-                        df_for_analysis = st.session_state.df_cleaned.copy()
-                        df_for_analysis["Weighted Date Diff"] = pd.to_numeric(df_for_analysis["Weighted Date Diff"], errors="coerce")
-                        top5_df = df_for_analysis.sort_values(by="Weighted Date Diff", ascending=False).head(5)
-                        
                         # If your Excel has "Client Name" / "Matter Number" columns, they will appear
                         columns_to_show = [
                             "Original Index for Avg Days",
@@ -408,8 +672,7 @@ with col2:
                             "TimeCard Entry Date",
                             "Days To Enter Time"
                         ]
-                        existing_cols = [col for col in columns_to_show if col in top5_df.columns]
-                        top5_df = top5_df[existing_cols]
+                        top5_df = timecard_analytics.worst_entries(5, columns=columns_to_show)
                         
                         st.markdown(
                             "**The following entries have contributed to an increased Average Days to Enter Time, "
@@ -447,39 +710,98 @@ with col2:
             st.session_state.df_cleaned is not None 
             and any(keyword in user_input.lower() for keyword in excel_analysis_keywords)
         ):
-            excel_response = answer_excel_question(user_input, st.session_state.df_cleaned)
-            st.session_state.conversation.append({"role": "assistant", "content": excel_response})
+            excel_response = answer_excel_question(user_input, st.session_state.timecard_analytics)
+            st.session_state.conversation.append("assistant", excel_response)
         
-        # Otherwise, use the general GPT answer
+        # Otherwise, use the general GPT answer, streamed into the column as it arrives
         else:
-            assistant_reply = find_best_answer_chunked(user_input, big_knowledge_text)
-            st.session_state.conversation.append({"role": "assistant", "content": assistant_reply})
+            from tracing import span
+
+            answer_placeholder = st.empty()
+            assistant_reply = ""
+            # One trace per question: retrieval, prompt assembly and the GPT stream are its child spans
+            with span("answer_question"):
+                for piece in find_best_answer_chunked(user_input, knowledge_base_bundle, stream=True):
+                    assistant_reply += piece
+                    answer_placeholder.markdown(f"**GPT:** {assistant_reply}▌")
+            answer_placeholder.markdown(f"**GPT:** {assistant_reply}")
+            answer_rendered = True
+            st.session_state.conversation.append("assistant", assistant_reply)
+            mark_timing("answer rendered")
 
         # Show the last GPT answer if not overridden
-        latest_gpt_answer = None
-        for msg in reversed(st.session_state.conversation):
-            if msg["role"] == "assistant":
-                latest_gpt_answer = msg["content"]
-                break
+        latest_gpt_answer = st.session_state.conversation.latest("assistant")
 
-        if latest_gpt_answer and "Projection Results" not in latest_gpt_answer:
+        if latest_gpt_answer and not answer_rendered and "Projection Results" not in latest_gpt_answer:
             st.markdown(f"**GPT:** {latest_gpt_answer}")
 
     with st.expander("Show Full Conversation History", expanded=False):
-        for msg in st.session_state.conversation:
-            if msg["role"] == "system":
-                continue
+        # One page of messages per rerun, newest page first
+        conversation = st.session_state.conversation
+        pages = conversation.page_count(DEFAULT_PAGE_SIZE)
+        page = st.number_input("Page (1 = most recent)", min_value=1, max_value=pages, value=1, step=1) if pages > 1 else 1
+        if page == pages and conversation.summary() and not conversation.persistent:
+            # Compacted messages are not kept; the oldest page starts with their summary
+            st.markdown(f"*Earlier: {conversation.summary()}*")
+        for msg in conversation.page(page, DEFAULT_PAGE_SIZE):
             role_label = "GPT" if msg["role"] == "assistant" else "You"
             st.markdown(f"**{role_label}:** {msg['content']}")
 
-    if st.button("Clear Conversation"):
-        st.session_state.conversation = [
-            {
-                "role": "system",
-                "content": (
-                    "You are an AI assistant that ONLY answers based on the provided knowledge base. "
-                    "If the answer is not in the knowledge base, reply with: 'I don't have information on that.'"
+    with st.expander("Cache Statistics", expanded=False):
+        # Only once a question has created the cache (keeps chunked_embeddings out of a cold start)
+        if get_process_state()["query_cache_ready"]:
+            for level, level_stats in get_query_cache().stats().items():
+                st.markdown(
+                    f"**{level.title()} cache:** {level_stats['hits']} hits, {level_stats['misses']} misses "
+                    f"({level_stats['hit_rate']:.0%} hit rate, {level_stats['size']} entries)"
                 )
-            }
-        ]
+            faq_index = knowledge_base_bundle["faq_index"]
+            if faq_index is not None:
+                faq_stats = faq_index.stats()
+                st.markdown(
+                    f"**FAQ answers (no GPT call):** {faq_stats['served']} of {faq_stats['total']} questions "
+                    f"({faq_stats['served_rate']:.0%})"
+                )
+        else:
+            st.markdown("No questions answered yet.")
+
+    if ADMIN_PANEL:
+        from tracing import stage_stats
+        with st.expander("Pipeline Timings (this process)", expanded=False):
+            rows = stage_stats.summary()
+            if not rows:
+                st.markdown("No spans recorded yet.")
+            else:
+                lines = [
+                    "| Stage | Calls | p50 ms | p95 ms | Max ms | API calls | Prompt tokens | Completion tokens | Embedding tokens | Errors |",
+                    "| --- | --- | --- | --- | --- | --- | --- | --- | --- | --- |",
+                ]
+                for row in rows:
+                    lines.append(
+                        f"| {row['stage']} | {row['count']} | {row['p50_ms']:.1f} | {row['p95_ms']:.1f} | {row['max_ms']:.1f} "
+                        f"| {row.get('api_calls', 0)} | {row.get('prompt_tokens', 0)} | {row.get('completion_tokens', 0)} "
+                        f"| {row.get('embedding_tokens', 0)} | {row['errors']} |"
+                    )
+                st.markdown("\n".join(lines))
+
+    if st.button("Clear Conversation"):
+        st.session_state.conversation.clear()
         # st.experimental_rerun()  # Uncomment if needed, but may cause issues in some environments
+
+# ------------------------------------------
+# Startup profile (APP_PROFILE_STARTUP=1 or ?profile=1)
+# ------------------------------------------
+mark_timing("end of run")
+process_state = get_process_state()
+process_state["runs"] += 1
+if PROFILE_STARTUP:
+    run_kind = "cold start" if process_state["runs"] == 1 else f"rerun #{process_state['runs']}"
+    loaded = [name for name in ("pandas", "numpy", "openai", "openpyxl", "tiktoken") if name in sys.modules]
+    logger.info(
+        "startup profile (%s): %s; heavy modules loaded: %s", run_kind,
+        ", ".join(f"{label}={elapsed:.3f}s" for label, elapsed in RUN_TIMINGS), ", ".join(loaded) or "none"
+    )
+    with st.expander(f"Startup Profile ({run_kind})", expanded=False):
+        for label, elapsed in RUN_TIMINGS:
+            st.markdown(f"- **{label}:** {elapsed * 1000:.0f} ms")
+        st.markdown(f"Heavy modules loaded: {', '.join(loaded) or 'none'}")
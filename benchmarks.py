@@ -0,0 +1,793 @@
+# benchmarks.py
+#
+# Offline performance benchmarks. No OpenAI key or network access needed: embedding and
+# chat calls go to llm_backend.FakeBackend (or an equivalent stub) with fixed latencies.
+# Usage: python benchmarks.py [retrieval|embedding|chunking|hybrid|prompt|ingestion|projection|store|analytics|reload|pipeline|conversation|sessions ...]
+#                             [--save baseline.json | --check baseline.json [--tolerance 0.25]]
+# 'hybrid' scores the vector and fused rankings with real embeddings when OPENAI_API_KEY is set,
+# with the fake backend's hashed embeddings otherwise.
+# --save writes each benchmark's headline metrics; --check compares a run against such a file
+# and exits with status 1 on a regression (see check_regressions).
+
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import openai
+
+from chunked_embeddings import (
+    split_text, rank_chunks, find_top_n_chunks, lexical_fast_path, ask_gpt, ChunkRetriever, QueryCache,
+    LEXICAL_FAST_PATH_CONFIDENCE, _build_gpt_messages
+)
+from embedding_client import BatchEmbeddingClient, count_tokens
+from excel_ingest import TIMECARD_COLUMNS, HEADER_ROW, load_timecards, read_timecards, stream_timecards
+from kb_loader import read_knowledge_base, convert_json_to_text, chunk_knowledge_base, faq_entries
+from lexical_index import BM25Index
+from llm_backend import FakeBackend, set_backend
+from projection import calculate_required_days, project_team, projection_grid
+from prompt_builder import DEFAULT_CONTEXT_TOKENS, build_context, count_message_tokens
+from tracing import span, stage_stats
+
+def _time_it(fn, repeat=5):
+    """
+    Runs fn() 'repeat' times and returns the best wall time in milliseconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def bench_retrieval(sizes=(1_000, 10_000, 100_000), dim=1536, k=2, batch=32):
+    """
+    Compares the per-chunk cosine loop (rank_chunks) with ChunkRetriever at several index sizes.
+    """
+    rng = np.random.default_rng(0)
+    metrics = {}
+    print(f"retrieval: dim={dim}, k={k}")
+    print(f"{'chunks':>8} {'loop ms':>10} {'vector ms':>10} {'speedup':>8} {'batch/q ms':>11}")
+    for size in sizes:
+        matrix = rng.standard_normal((size, dim), dtype=np.float32)
+        chunks = [f"chunk {i}" for i in range(size)]
+        embeddings = [{"chunk": chunk, "embedding": row} for chunk, row in zip(chunks, matrix)]
+        queries = rng.standard_normal((batch, dim), dtype=np.float32)
+        retriever = ChunkRetriever(chunks, matrix)
+
+        # Both paths must agree on the winners
+        assert [c for _, c in rank_chunks(queries[0], embeddings, n=k)] == \
+               [c for _, c in retriever.search(queries[0], k=k)]
+
+        loop_ms = _time_it(lambda: rank_chunks(queries[0], embeddings, n=k), repeat=1 if size >= 100_000 else 3)
+        vector_ms = _time_it(lambda: retriever.search(queries[0], k=k))
+        batch_ms = _time_it(lambda: retriever.search_batch(queries, k=k)) / batch
+        print(f"{size:>8} {loop_ms:>10.2f} {vector_ms:>10.3f} {loop_ms / vector_ms:>7.0f}x {batch_ms:>11.3f}")
+        metrics[f"vector_{size}_ms"] = vector_ms
+    return metrics
+
+class FakeEmbeddingAPI:
+    """
+    Stand-in for openai.Embedding.create: sleeps 'latency' seconds per request and
+    answers with 429 for a 'rate_limit_rate' fraction of requests.
+    """
+
+    def __init__(self, dim=1536, latency=0.05, rate_limit_rate=0.0, seed=0):
+        self.dim = dim
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self, input, model, **kwargs):
+        time.sleep(self.latency)
+        if self.rng.random() < self.rate_limit_rate:
+            raise openai.error.RateLimitError("Rate limit reached (fake)")
+        return {"data": [
+            {"index": i, "embedding": [float(len(text))] * self.dim}
+            for i, text in enumerate(input)
+        ]}
+
+def bench_embedding(num_chunks=2_000, latency=0.05, rate_limit_rate=0.05):
+    """
+    Compares one-request-per-chunk embedding with the batched, concurrent client
+    against a fake API with fixed per-request latency and occasional 429s.
+    """
+    texts = [f"chunk {i} " + "word " * 300 for i in range(num_chunks)]
+    print(f"embedding: {num_chunks} chunks, {latency * 1000:.0f} ms/request, {rate_limit_rate:.0%} 429s")
+    configs = [
+        ("serial, 1 per request", dict(max_batch_size=1, max_workers=1)),
+        ("batched, 1 worker", dict(max_workers=1)),
+        ("batched, 4 workers", dict(max_workers=4)),
+    ]
+    metrics = {}
+    for label, kwargs in configs:
+        client = BatchEmbeddingClient(
+            create_fn=FakeEmbeddingAPI(dim=8, latency=latency, rate_limit_rate=rate_limit_rate),
+            base_delay=latency, **kwargs
+        )
+        # The serial baseline is extrapolated from a slice so the run stays short
+        sample = texts[:100] if kwargs.get("max_batch_size") == 1 else texts
+        start = time.perf_counter()
+        vectors = client.embed(sample)
+        elapsed = (time.perf_counter() - start) * len(texts) / len(sample)
+        assert [v[0] for v in vectors] == [float(len(t)) for t in sample]
+        print(f"{label:>24}: {elapsed:7.2f} s  ({client.request_count} requests, {client.retry_count} retries)")
+    metrics["batched_4_workers_ms"] = elapsed * 1000
+    return metrics
+
+def bench_chunking(top_n=2):
+    """
+    Compares the 300-word / 50-overlap split_text chunks with the structure-aware chunker
+    on knowledge_base.json: chunk counts (= embedding inputs), tokens embedded, and the
+    tokens that the top-n chunks add to every GPT prompt.
+    """
+    kb = read_knowledge_base()
+    structured = [c["text"] for c in chunk_knowledge_base(kb)]
+    variants = [
+        ("split_text, answer/content only", split_text(convert_json_to_text(kb), chunk_size=300, overlap=50)),
+        ("split_text, same sections", split_text("\n".join(structured), chunk_size=300, overlap=50)),
+        ("structure-aware", structured),
+    ]
+    print(f"chunking: knowledge_base.json, prompt = top {top_n} chunks")
+    print(f"{'variant':>32} {'chunks':>7} {'embed tok':>10} {'mean tok':>9} {'max tok':>8} {'prompt tok':>11} {'worst prompt':>13}")
+    for label, chunks in variants:
+        tokens = sorted((count_tokens(chunk) for chunk in chunks), reverse=True)
+        mean = sum(tokens) / len(tokens)
+        print(f"{label:>32} {len(chunks):>7} {sum(tokens):>10} {mean:>9.0f} {tokens[0]:>8} "
+              f"{mean * top_n:>11.0f} {sum(tokens[:top_n]):>13}")
+    return {"structured_embed_tokens": sum(tokens), "structured_worst_prompt_tokens": sum(tokens[:top_n])}
+
+# Fixed question set for retrieval quality: question -> IDs of chunks that answer it
+RETRIEVAL_QUESTIONS = [
+    ("What is the time entry cutoff for March 2025?", {"time-entry-cutoff-policy-0"}),
+    ("When is the October 2025 month end cutoff?", {"time-entry-cutoff-policy-1"}),
+    ("Who do I call with a question about Intapp Time?", {"intapp-faq-0"}),
+    ("Can I sort my timecards?", {"intapp-faq-1"}),
+    ("Can I edit a timecard after it is finalized?", {"intapp-faq-1", "faq-0"}),
+    ("Does Intapp Time work in Citrix?", {"intapp-faq-4"}),
+    ("How much is my bonus reduced if my average is over 8 days?", {"time-entry-policy-1"}),
+    ("When does the average reset for counsel?", {"time-entry-policy-1", "average-days-to-enter-time-1"}),
+    ("What time is the daily snapshot taken?", {"time-entry-policy-1", "test-error-handling-in-json-0", "test-error-handling-in-json-2"}),
+    ("Does the metric count weekends and holidays?", {"additional-questions-and-answers-0", "time-entry-policy-1"}),
+    ("What happens if I forget to finalize my time?", {"additional-questions-and-answers-0"}),
+    ("How is leave or secondment treated?", {"time-entry-policy-1", "additional-questions-and-answers-2", "faq-1"}),
+    ("What is block billing?", {"time-entry-narrative-tips-and-guidelines-1"}),
+    ("Should narratives use abbreviations?", {"time-entry-narrative-tips-and-guidelines-0", "faq-1"}),
+    ("How many hours do I need to record each day?", {"standards-for-time-recordkeeping-and-reporting-1"}),
+    ("Can I bill travel time?", {"standards-for-time-recordkeeping-and-reporting-2"}),
+    ("Why is my metric showing unusually high values?", {"test-error-handling-in-json-1"}),
+    ("My finalized entries are not in the metric yet", {"test-error-handling-in-json-2", "test-error-handling-in-json-0"}),
+    ("Who do I contact if I am locked out of the time entry system?", {"additional-questions-and-answers-1", "faq-1"}),
+    ("How can I lower my average days to enter time?", {"user-interaction-workflow-0"}),
+    ("Why does my calculated average differ from cell A2?", {"faq-0"}),
+    ("Can I contest an entry that hurt my metric?", {"additional-questions-and-answers-2", "faq-2"}),
+]
+
+def _rank_of(ranking, expected_texts):
+    return next((rank for rank, (_, chunk) in enumerate(ranking, start=1) if chunk in expected_texts), None)
+
+def bench_hybrid(top_n=2, candidates=10):
+    """
+    Retrieval quality (hit@top_n, MRR@candidates) and per-query latency on RETRIEVAL_QUESTIONS for
+    BM25 alone, the embedding ranking and the RRF fusion of both. Without an OpenAI key the
+    embeddings come from FakeBackend (hashed words), so only the BM25 numbers are meaningful.
+    Also reports how many questions the lexical fast path answers without a query embedding,
+    and checks that the app's routing (FAQ match, then retrieval) sends no embedding request for them.
+    """
+    from faq_index import build_faq_index
+
+    chunks = chunk_knowledge_base(read_knowledge_base())
+    texts = [chunk["text"] for chunk in chunks]
+    text_by_id = {chunk["id"]: chunk["text"] for chunk in chunks}
+    questions = [(question, {text_by_id[i] for i in ids}) for question, ids in RETRIEVAL_QUESTIONS]
+    lexical = BM25Index(texts)
+
+    variants = [("bm25", lambda q: lexical.search(q, k=candidates))]
+    from embedding_store import build_store
+    previous = None
+    if os.environ.get("OPENAI_API_KEY"):
+        openai.api_key = os.environ["OPENAI_API_KEY"]
+        label = ""
+    else:
+        previous = set_backend(FakeBackend())
+        label = " (fake)"
+    try:
+        with tempfile.TemporaryDirectory() as index_dir:
+            retriever = build_store(texts, chunk_size=300, index_dir=index_dir).retriever()
+        cache = QueryCache()
+        for question, _ in questions:
+            cache.get_embedding(question)  # embedding calls stay out of the latency numbers
+    finally:
+        if previous is not None:
+            set_backend(previous)
+    variants += [
+        ("vector" + label, lambda q: find_top_n_chunks(q, retriever, n=candidates, cache=cache)),
+        ("rrf" + label, lambda q: find_top_n_chunks(
+            q, retriever, n=candidates, cache=cache, lexical_index=lexical,
+            fast_path_confidence=None, candidates=candidates)),
+    ]
+
+    print(f"hybrid: {len(questions)} questions, {len(texts)} chunks, hit@{top_n}, MRR@{candidates}")
+    print(f"{'ranking':>14} {'hit@' + str(top_n):>7} {'MRR':>6} {'ms/query':>9}")
+    metrics = {}
+    for label, search in variants:
+        ranks = [_rank_of(search(question), expected) for question, expected in questions]
+        hits = sum(1 for rank in ranks if rank is not None and rank <= top_n) / len(ranks)
+        mrr = sum(1.0 / rank for rank in ranks if rank is not None) / len(ranks)
+        elapsed = _time_it(lambda: [search(question) for question, _ in questions]) / len(questions)
+        print(f"{label:>14} {hits:>7.0%} {mrr:>6.3f} {elapsed:>9.3f}")
+        if label == "bm25":
+            metrics.update(bm25_hit_rate=hits, bm25_mrr=mrr, bm25_query_ms=elapsed)
+
+    fast = [
+        (question, expected) for question, expected in questions
+        if lexical_fast_path(question, lexical, n=top_n, candidates=candidates)
+    ]
+    fast_hits = sum(1 for question, expected in fast if _rank_of(lexical.search(question, k=top_n), expected))
+    print(f"lexical fast path (confidence >= {LEXICAL_FAST_PATH_CONFIDENCE}): {len(fast)}/{len(questions)} questions "
+          f"skip the embedding call, {fast_hits}/{len(fast)} of them with a correct chunk in the top {top_n}")
+
+    # The same questions through the app's routing (find_best_answer_chunked): FAQ match, then retrieval
+    backend = FakeBackend()
+    previous = set_backend(backend)
+    try:
+        with tempfile.TemporaryDirectory() as index_dir:
+            faq_index = build_faq_index(faq_entries(read_knowledge_base()), index_dir=index_dir)
+        requests_before = backend.embedding_requests
+        faq_served = 0
+        for question, _ in fast:
+            cache = QueryCache()
+            embed_fn = None if lexical_fast_path(question, lexical, n=top_n, candidates=candidates) else cache.get_embedding
+            faq_served += faq_index.match(question, embed_fn) is not None
+            find_top_n_chunks(question, retriever, n=top_n, cache=cache, lexical_index=lexical, candidates=candidates)
+        fast_embeddings = backend.embedding_requests - requests_before
+    finally:
+        set_backend(previous)
+    print(f"fast-path questions through FAQ + retrieval: {fast_embeddings} embedding requests, "
+          f"{faq_served} answered from the FAQ")
+    assert fast_embeddings == 0, fast_embeddings
+    metrics["fast_path_hits"] = fast_hits
+    return metrics
+
+def bench_prompt(candidates=3, budgets=(300, DEFAULT_CONTEXT_TOKENS, 500, 800)):
+    """
+    Prompt tokens per question on RETRIEVAL_QUESTIONS (BM25 ranking): the previous prompt
+    (top 2 chunks with score labels) against build_context at several budgets, for the
+    structure-aware chunks and for 300-word / 50-overlap split_text chunks.
+    'answer kept' = questions whose context still contains part of an expected chunk.
+    """
+    kb = read_knowledge_base()
+    chunks = chunk_knowledge_base(kb)
+    text_by_id = {chunk["id"]: chunk["text"] for chunk in chunks}
+    corpora = [
+        ("structured", [chunk["text"] for chunk in chunks]),
+        ("split_text", split_text(convert_json_to_text(kb), chunk_size=300, overlap=50)),
+    ]
+    metrics = {}
+    print(f"prompt: {len(RETRIEVAL_QUESTIONS)} questions, BM25 top {candidates} candidates")
+    print(f"{'chunks':>11} {'prompt':>16} {'mean tok':>9} {'max tok':>8} {'answer kept':>12} {'dup/overlap':>12} {'ms':>6}")
+    for corpus, texts in corpora:
+        lexical = BM25Index(texts)
+        rankings = [(question, lexical.search(question, k=candidates), ids) for question, ids in RETRIEVAL_QUESTIONS]
+
+        def previous(ranking):
+            context = "\n\n".join(f"[Score: {score:.3f}] {chunk}" for score, chunk in ranking[:2])
+            return context, {"duplicate_units": 0, "overlap_words": 0}
+
+        variants = [("top 2 + scores", previous)] + [
+            (f"budget {budget}", lambda ranking, budget=budget: build_context(ranking, max_tokens=budget))
+            for budget in budgets
+        ]
+        for label, build in variants:
+            tokens, kept, removed = [], 0, 0
+            for question, ranking, ids in rankings:
+                context, stats = build(ranking)
+                tokens.append(count_message_tokens(_build_gpt_messages(question, context)))
+                removed += stats["duplicate_units"] + stats["overlap_words"]
+                # structured chunks are checked by their first content line, split_text chunks by the best hit
+                expected = [text_by_id[i].splitlines()[1] for i in ids] if corpus == "structured" else [ranking[0][1][:80]]
+                flat = " ".join(context.split())
+                kept += any(" ".join(line.split())[:80] in flat for line in expected)
+            elapsed = _time_it(lambda: [build(ranking) for _, ranking, _ in rankings], repeat=3) / len(rankings)
+            print(f"{corpus:>11} {label:>16} {sum(tokens) / len(tokens):>9.0f} {max(tokens):>8} "
+                  f"{kept:>5}/{len(rankings):<6} {removed:>12} {elapsed:>6.2f}")
+            if label == f"budget {DEFAULT_CONTEXT_TOKENS}":
+                metrics[f"{corpus}_mean_tokens"] = sum(tokens) / len(tokens)
+                metrics[f"{corpus}_answers_kept"] = kept
+    return metrics
+
+# ------------------------------------------
+# Synthetic timecard exports (Excel ingestion / projection)
+# ------------------------------------------
+SYNTHETIC_TIMEKEEPERS = 200
+SYNTHETIC_TITLES = ["Associate", "Counsel", "Partner", "Staff Attorney"]
+# Export columns in sheet order: the ones the app reads plus a few it skips
+SYNTHETIC_COLUMNS = [
+    "Original Index for Avg Days", "Timekeeper", "Title", "Client Name", "Matter Number", "Timecard Index",
+    "Work Date", "TimeCard Entry Date", "Days To Enter Time", "Hours Worked", "Weighted Date Diff", "Narrative",
+]
+
+def synthetic_timecards(rows, seed=0):
+    """
+    Returns a DataFrame of 'rows' random timecards in the export's columns
+    (SYNTHETIC_TIMEKEEPERS timekeepers, entry delays of 0-29 days, 0.5-9.5 hours).
+    """
+    rng = np.random.default_rng(seed)
+    timekeeper = rng.integers(0, SYNTHETIC_TIMEKEEPERS, rows)
+    delay = rng.integers(0, 30, rows)
+    hours = rng.integers(1, 20, rows) / 2
+    work_date = np.datetime64("2024-10-01") + rng.integers(0, 300, rows).astype("timedelta64[D]")
+    return pd.DataFrame({
+        "Original Index for Avg Days": np.arange(1, rows + 1),
+        "Timekeeper": [f"Timekeeper {i:03d}" for i in timekeeper],
+        "Title": [SYNTHETIC_TITLES[i % len(SYNTHETIC_TITLES)] for i in timekeeper],
+        "Client Name": [f"Client {i}" for i in rng.integers(0, 400, rows)],
+        "Matter Number": [f"{i}-0001" for i in rng.integers(10_000, 12_000, rows)],
+        "Timecard Index": np.arange(500_000, 500_000 + rows),
+        "Work Date": pd.to_datetime(work_date),
+        "TimeCard Entry Date": pd.to_datetime(work_date + delay.astype("timedelta64[D]")),
+        "Days To Enter Time": delay.astype(np.float64),
+        "Hours Worked": hours,
+        "Weighted Date Diff": delay * hours,
+        "Narrative": "Review and revise draft agreement; correspondence with client regarding same",
+    })
+
+def synthetic_export(rows, seed=0):
+    """
+    Returns the bytes of a synthetic "Average Days to Enter Time Detail" workbook with 'rows'
+    timecards: title, A2 average and run-date rows above the header, two summary rows below.
+    Written once per (rows, seed) with openpyxl's write-only mode and kept in the temp directory.
+    """
+    path = os.path.join(tempfile.gettempdir(), f"timecards-bench-{rows}-{seed}.xlsx")
+    if not os.path.exists(path):
+        from openpyxl import Workbook
+
+        df = synthetic_timecards(rows, seed)
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        preamble = [["Average Days to Enter Time Detail"], [float(df["Weighted Date Diff"].sum() / df["Hours Worked"].sum())],
+                    ["Run Date", "2025-08-01"]]
+        assert len(preamble) == HEADER_ROW
+        for row in preamble:
+            sheet.append(row)
+        sheet.append(SYNTHETIC_COLUMNS)
+        for row in df[SYNTHETIC_COLUMNS].itertuples(index=False):
+            sheet.append([value.to_pydatetime() if isinstance(value, pd.Timestamp) else value for value in row])
+        totals = {"Hours Worked": float(df["Hours Worked"].sum()), "Weighted Date Diff": float(df["Weighted Date Diff"].sum())}
+        sheet.append([totals.get(column) for column in SYNTHETIC_COLUMNS])
+        sheet.append(["Total"] + [totals["Weighted Date Diff"] / totals["Hours Worked"] if column == "Weighted Date Diff" else None
+                                  for column in SYNTHETIC_COLUMNS[1:]])
+        tmp_path = path + ".tmp"
+        workbook.save(tmp_path)
+        os.replace(tmp_path, path)
+    with open(path, "rb") as f:
+        return f.read()
+
+def _peak_mb(fn):
+    # Peak Python heap allocation while fn() runs
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+def bench_ingestion(sizes=(10_000, 100_000)):
+    """
+    Parse + clean time of synthetic exports (read_timecards, TIMECARD_COLUMNS), the cached
+    load_timecards path taken on every rerun, and the memory of the cleaned frame.
+    Peak heap: whole-sheet pd.read_excel (the previous reader) against the streaming reader,
+    and against stream_timecards(keep_rows=False), which only keeps the running totals.
+    """
+    metrics = {}
+    print(f"ingestion: synthetic exports, {len(SYNTHETIC_COLUMNS)} columns ({len(TIMECARD_COLUMNS)} read)")
+    print(f"{'rows':>8} {'MB':>6} {'read ms':>10} {'rows/s':>9} {'cached ms':>10} {'frame MB':>9} "
+          f"{'peak MB: read_excel':>20} {'streamed':>9} {'totals only':>12}")
+    for size in sizes:
+        data = synthetic_export(size)
+        df = read_timecards(data)
+        assert len(df) == size, (len(df), size)
+        read_ms = _time_it(lambda: read_timecards(data), repeat=1 if size >= 100_000 else 3)
+        load_timecards(data)
+        cached_ms = _time_it(lambda: load_timecards(data))
+        frame_mb = df.memory_usage(deep=True).sum() / 1e6
+        whole_peak = _peak_mb(lambda: pd.read_excel(io.BytesIO(data), engine="openpyxl", header=None))
+        stream_peak = _peak_mb(lambda: read_timecards(data))
+        totals_peak = _peak_mb(lambda: stream_timecards(data, keep_rows=False))
+        print(f"{size:>8} {len(data) / 1e6:>6.1f} {read_ms:>10.0f} {size / read_ms * 1000:>9.0f} "
+              f"{cached_ms:>10.2f} {frame_mb:>9.1f} {whole_peak:>20.1f} {stream_peak:>9.1f} {totals_peak:>12.1f}")
+        metrics[f"read_{size}_ms"] = read_ms
+        metrics[f"cached_{size}_ms"] = cached_ms
+    return metrics
+
+def bench_projection(sizes=(10_000, 100_000), promised_hours=7.5, delay=1.0):
+    """
+    Team projection (project_team, one row per timekeeper) on synthetic timecards, the
+    what-if grid (projection_grid) and the scalar calculate_required_days.
+    """
+    metrics = {}
+    print(f"projection: {SYNTHETIC_TIMEKEEPERS} timekeepers, {promised_hours} h/day, {delay} day delay")
+    print(f"{'rows':>8} {'team ms':>9} {'grid ms':>9} {'scalar us':>10}")
+    for size in sizes:
+        df = synthetic_timecards(size)
+        for column in ("Timekeeper", "Title", "Client Name", "Matter Number"):
+            df[column] = df[column].astype("category")  # as read_timecards returns them
+        team = project_team(df, "Timekeeper", promised_hours, delay, title_column="Title")
+        assert len(team) == df["Timekeeper"].nunique()
+        team_ms = _time_it(lambda: project_team(df, "Timekeeper", promised_hours, delay, title_column="Title"))
+        weighted, hours = float(df["Weighted Date Diff"].sum()), float(df["Hours Worked"].sum())
+        grid_ms = _time_it(lambda: projection_grid(weighted, hours, "2025-08-01"))
+        scalar_us = _time_it(lambda: [calculate_required_days(weighted, hours, promised_hours, delay) for _ in range(1000)])
+        print(f"{size:>8} {team_ms:>9.2f} {grid_ms:>9.2f} {scalar_us:>10.2f}")
+        metrics[f"team_{size}_ms"] = team_ms
+        metrics[f"grid_{size}_ms"] = grid_ms
+    return metrics
+
+def bench_analytics(sizes=(10_000, 100_000)):
+    """
+    The per-upload offender index (TimecardAnalytics): building it once, then the projection
+    view's top-5 table from it against the copy + to_numeric + full sort it replaced, and a
+    drill-down (worst 10 entries of one matter).
+    """
+    from excel_analytics import TimecardAnalytics
+
+    metrics = {}
+    print("analytics: top-offender index per upload")
+    print(f"{'rows':>8} {'build ms':>9} {'sort top5 ms':>13} {'index top5 ms':>14} {'matter top10 ms':>16}")
+    for size in sizes:
+        df = synthetic_timecards(size)
+        for column in ("Timekeeper", "Title", "Client Name", "Matter Number"):
+            df[column] = df[column].astype("category")  # as read_timecards returns them
+        analytics = TimecardAnalytics(df)
+        build_ms = _time_it(lambda: TimecardAnalytics(df), repeat=3)
+
+        def sort_top5():
+            df_for_analysis = df.copy()
+            df_for_analysis["Weighted Date Diff"] = pd.to_numeric(df_for_analysis["Weighted Date Diff"], errors="coerce")
+            return df_for_analysis.sort_values(by="Weighted Date Diff", ascending=False).head(5)
+
+        expected = sort_top5()["Weighted Date Diff"].to_numpy()
+        assert (analytics.worst_entries(5)["Weighted Date Diff"].to_numpy() == expected).all()
+        sort_ms = _time_it(sort_top5)
+        index_ms = _time_it(lambda: analytics.worst_entries(5, columns=TIMECARD_COLUMNS))
+        matter = str(df["Matter Number"].iloc[0])
+        matter_ms = _time_it(lambda: analytics.group_entries("matter", matter, 10))
+        print(f"{size:>8} {build_ms:>9.1f} {sort_ms:>13.2f} {index_ms:>14.2f} {matter_ms:>16.2f}")
+        metrics[f"build_{size}_ms"] = build_ms
+        metrics[f"top5_{size}_ms"] = index_ms
+    return metrics
+
+def bench_timecard_store(rows=10_000, weekly_rows=200):
+    """
+    The per-user Parquet store on a weekly re-upload ('weekly_rows' new timecards): the
+    append and totals update after parsing, reopening the stored rows (a new session or a
+    re-upload of the same file) against parsing the export again, and the XLSX export that
+    used to run on every rerun and now only runs on download.
+    """
+    from timecard_store import TimecardStore, export_xlsx
+
+    upload = read_timecards(synthetic_export(rows))
+    last_week = upload.iloc[:rows - weekly_rows]
+    with tempfile.TemporaryDirectory() as store_dir:
+        store = TimecardStore("bench", store_dir=store_dir)
+        store.ingest(b"last week", parse=lambda data, columns: last_week)
+        start = time.perf_counter()
+        _, stats = store.ingest(b"this week", parse=lambda data, columns: upload)
+        append_ms = (time.perf_counter() - start) * 1000
+        assert stats["new_rows"] == weekly_rows and store.rows == rows
+        assert abs(store.totals["Hours Worked"] - upload["Hours Worked"].sum()) < 1e-6
+        reopen_ms = _time_it(lambda: TimecardStore("bench", store_dir=store_dir).frame(), repeat=3)
+        parse_ms = _time_it(lambda: read_timecards(synthetic_export(rows)), repeat=1)
+    export_ms = _time_it(lambda: export_xlsx(upload), repeat=1)
+    print(f"timecard store: {rows} rows, {weekly_rows} new this week")
+    print(f"append + totals {append_ms:.1f} ms; reopen from Parquet {reopen_ms:.1f} ms vs parse export {parse_ms:.0f} ms; "
+          f"XLSX export (now on download only) {export_ms:.0f} ms")
+    return {"append_ms": append_ms, "reopen_ms": reopen_ms}
+
+# ------------------------------------------
+# End-to-end question answering on the fake backend
+# ------------------------------------------
+def bench_reload(edited_sections=1, embedding_latency=0.2, interval=0.05, query_pause=0.005):
+    """
+    Hot reload of the knowledge base (kb_watcher) after 'edited_sections' sections change:
+    chunks embedded by the background rebuild, time until the new version is served, and
+    the worst latency of the queries answered from the old version meanwhile, against the
+    first query after a synchronous rebuild (a restart, or a cache miss on the new file).
+    """
+    from embedding_store import build_store
+    from kb_loader import DEFAULT_CHUNK_TOKENS, parse_knowledge_base
+    from kb_watcher import KnowledgeBaseWatcher
+
+    previous = set_backend(FakeBackend(embedding_latency=embedding_latency))
+    kb = read_knowledge_base()
+    query = np.random.default_rng(0).standard_normal(1536).astype(np.float32)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            kb_path, index_dir = os.path.join(tmp, "knowledge_base.json"), os.path.join(tmp, "index")
+
+            def write_kb():
+                with open(kb_path, "w", encoding="utf-8") as f:
+                    json.dump(kb, f)
+
+            def build(data):
+                chunks = [c["text"] for c in chunk_knowledge_base(parse_knowledge_base(data))]
+                store = build_store(chunks, chunk_size=DEFAULT_CHUNK_TOKENS, index_dir=index_dir, mmap=True)
+                return store.retriever(), store.last_embedded_count
+
+            write_kb()
+            watcher = KnowledgeBaseWatcher(kb_path, build, interval=interval)
+            watcher.reload()
+            watcher.start()
+            sections = kb["knowledge_base"]["sections"]
+            for name in list(sections)[:edited_sections]:
+                sections[name]["Reload note"] = f"Edited while the app was running ({name})."
+            write_kb()
+
+            # Sessions keep querying the served version while the new one is built
+            latencies, start = [], time.perf_counter()
+            while watcher.current().number == 1 and time.perf_counter() - start < 60:
+                retriever, _ = watcher.current().value
+                query_start = time.perf_counter()
+                retriever.top_k(query, k=3)
+                latencies.append(time.perf_counter() - query_start)
+                time.sleep(query_pause)
+            swap_s = time.perf_counter() - start
+            watcher.stop()
+            version = watcher.current()
+            assert version.number == 2, watcher.last_error
+            retriever, embedded = version.value
+
+            sections[list(sections)[0]]["Reload note"] = "Edited again, for the synchronous rebuild."
+            write_kb()
+            sync_start = time.perf_counter()
+            with open(kb_path, "rb") as f:
+                build(f.read())[0].top_k(query, k=3)
+            sync_ms = (time.perf_counter() - sync_start) * 1000
+    finally:
+        set_backend(previous)
+    worst_ms = max(latencies) * 1000
+    print(f"reload: {edited_sections} edited section(s), {len(retriever)} chunks, {embedding_latency * 1000:.0f} ms per embedding request")
+    print(f"  background rebuild: {embedded} chunks embedded, version 2 served after {swap_s:.2f}s "
+          f"(build {version.build_seconds:.2f}s, polling {interval}s)")
+    print(f"  {len(latencies)} queries answered from version 1 meanwhile, worst {worst_ms:.2f} ms")
+    print(f"  synchronous rebuild: first query after the edit took {sync_ms:.0f} ms")
+    return {"worst_query_ms": worst_ms}
+
+def bench_pipeline(embedding_latency=0.02, chat_latency=0.05, candidates=3):
+    """
+    The app's general-question path (find_top_n_chunks -> build_context -> ask_gpt) for every
+    question in RETRIEVAL_QUESTIONS, on FakeBackend with fixed per-request latencies.
+    Reports the cold index build, the first and the repeated (query-cached) pass, and the
+    per-stage p50 / p95 from the span statistics.
+    """
+    from embedding_store import build_store
+
+    backend = FakeBackend(embedding_latency=embedding_latency, chat_latency=chat_latency)
+    previous = set_backend(backend)
+    try:
+        texts = [chunk["text"] for chunk in chunk_knowledge_base(read_knowledge_base())]
+        with tempfile.TemporaryDirectory() as index_dir:
+            start = time.perf_counter()
+            retriever = build_store(texts, chunk_size=300, index_dir=index_dir).retriever()
+            build_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            build_store(texts, chunk_size=300, index_dir=index_dir)
+            reload_ms = (time.perf_counter() - start) * 1000
+        lexical = BM25Index(texts)
+        cache = QueryCache()
+
+        def answer(question):
+            with span("answer_question"):
+                top_chunks = find_top_n_chunks(question, retriever, n=candidates, cache=cache, lexical_index=lexical)
+                context, _ = build_context(top_chunks)
+                return ask_gpt(question, context)
+
+        stage_stats.clear()
+        passes = []
+        for _ in range(2):
+            start = time.perf_counter()
+            for question, _ in RETRIEVAL_QUESTIONS:
+                assert answer(question)
+            passes.append((time.perf_counter() - start) * 1000 / len(RETRIEVAL_QUESTIONS))
+    finally:
+        set_backend(previous)
+
+    print(f"pipeline: fake backend, {embedding_latency * 1000:.0f} ms/embedding request, "
+          f"{chat_latency * 1000:.0f} ms/completion, {len(texts)} chunks, {len(RETRIEVAL_QUESTIONS)} questions")
+    print(f"index build {build_ms:.0f} ms (reload {reload_ms:.1f} ms); "
+          f"ms/question: first pass {passes[0]:.1f}, cached embeddings {passes[1]:.1f}; "
+          f"{backend.embedding_requests} embedding / {backend.chat_requests} chat requests")
+    print(f"{'stage':>22} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for row in stage_stats.summary():
+        print(f"{row['stage']:>22} {row['count']:>6} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['max_ms']:>8.2f}")
+    return {"reload_ms": reload_ms, "question_ms": passes[0], "cached_question_ms": passes[1]}
+
+# ------------------------------------------
+# Conversation history
+# ------------------------------------------
+def bench_conversation(turns=(10, 100, 1_000, 10_000), answer_words=150):
+    """
+    Memory held by a ConversationStore and the cost of reading one history page (what a
+    rerun renders) as the conversation grows, in memory and with a SQLite file.
+    """
+    import tracemalloc
+    from conversation_store import ConversationStore, DEFAULT_PAGE_SIZE
+
+    answer = " ".join(["word"] * answer_words)
+    metrics = {}
+    print(f"conversation: {answer_words}-word answers, page size {DEFAULT_PAGE_SIZE}")
+    print(f"{'turns':>7} {'store':>7} {'memory KB':>10} {'page ms':>8}")
+    for count in turns:
+        for label in ("memory", "sqlite"):
+            with tempfile.TemporaryDirectory() as directory:
+                tracemalloc.start()
+                store = ConversationStore(db_path=os.path.join(directory, "session.sqlite3") if label == "sqlite" else None)
+                for i in range(count):
+                    store.append("user", f"Question {i}: what is the cutoff for this month?")
+                    store.append("assistant", f"{answer} {i}")  # distinct strings, as real answers are
+                memory_kb = tracemalloc.get_traced_memory()[0] / 1024
+                tracemalloc.stop()
+                page_ms = _time_it(lambda: store.page(1, DEFAULT_PAGE_SIZE))
+                store.clear()
+            print(f"{count:>7} {label:>7} {memory_kb:>10.0f} {page_ms:>8.3f}")
+            metrics[f"{label}_page_{count}_ms"] = page_ms
+    return metrics
+
+# ------------------------------------------
+# Concurrent sessions (shared resource layer)
+# ------------------------------------------
+def _rss_mb():
+    # Current resident set size; Linux /proc, else the peak from getrusage
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _session_resources(index_dir, kb_copies, mmap):
+    # What one session needs to answer questions; the knowledge base is repeated 'kb_copies' times
+    from embedding_store import build_store
+
+    chunks = [chunk["text"] for chunk in chunk_knowledge_base(read_knowledge_base())]
+    texts = [f"{text}\n(copy {copy})" for copy in range(kb_copies) for text in chunks]
+    store = build_store(texts, chunk_size=300, index_dir=index_dir, mmap=mmap)
+    return {"retriever": store.retriever(), "lexical": BM25Index(texts), "cache": QueryCache()}
+
+def _run_session(number, resources, questions):
+    latencies = []
+    for i in range(questions):
+        question = RETRIEVAL_QUESTIONS[(number + i) % len(RETRIEVAL_QUESTIONS)][0]
+        start = time.perf_counter()
+        top_chunks = find_top_n_chunks(
+            question, resources["retriever"], n=3, cache=resources["cache"], lexical_index=resources["lexical"]
+        )
+        context, _ = build_context(top_chunks)
+        ask_gpt(question, context)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def _measure_sessions(index_dir, count, layer, kb_copies, questions, embedding_latency, chat_latency):
+    # Runs in a fresh process so the RSS numbers of one configuration do not leak into the next
+    from concurrent.futures import ThreadPoolExecutor
+
+    set_backend(FakeBackend(embedding_latency=embedding_latency, chat_latency=chat_latency))
+    before = _rss_mb()
+    if layer == "shared":
+        resources = [_session_resources(index_dir, kb_copies, mmap=True)] * count
+    else:
+        resources = [_session_resources(index_dir, kb_copies, mmap=False) for _ in range(count)]
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        latencies = sum(pool.map(_run_session, range(count), resources, [questions] * count), [])
+    return _rss_mb() - before, sorted(latencies)
+
+def bench_sessions(sessions=(1, 8, 32), questions_per_session=5, kb_copies=100,
+                   embedding_latency=0.02, chat_latency=0.05):
+    """
+    Load test: N simulated sessions, one thread each as Streamlit runs them, answer questions
+    concurrently on FakeBackend. The knowledge base is repeated 'kb_copies' times so the index
+    has a realistic size. "per-session" gives every session its own parsed knowledge base,
+    chunks, embedding matrix, BM25 index and query cache. "shared" gives all sessions the
+    same ones, with the matrix memory-mapped, as the app's st.cache_resource layer does.
+    Reports the RSS added by the sessions and the question latency p50 / p95.
+    """
+    import multiprocessing
+
+    metrics = {}
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as index_dir:
+        previous = set_backend(FakeBackend())
+        try:
+            _session_resources(index_dir, kb_copies, mmap=False)  # embeds once; the sessions only load the index
+        finally:
+            set_backend(previous)
+        print(f"sessions: {questions_per_session} questions each, {kb_copies}x knowledge base, fake backend "
+              f"({embedding_latency * 1000:.0f} ms/embedding, {chat_latency * 1000:.0f} ms/completion)")
+        print(f"{'sessions':>9} {'layer':>12} {'RSS +MB':>8} {'MB/session':>11} {'p50 ms':>8} {'p95 ms':>8}")
+        for count in sessions:
+            for layer in ("per-session", "shared"):
+                with context.Pool(1) as pool:
+                    added, latencies = pool.apply(
+                        _measure_sessions, (index_dir, count, layer, kb_copies, questions_per_session, embedding_latency, chat_latency)
+                    )
+                p50 = latencies[len(latencies) // 2]
+                p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                print(f"{count:>9} {layer:>12} {added:>8.1f} {added / count:>11.2f} {p50:>8.1f} {p95:>8.1f}")
+                metrics[f"{layer}_{count}_p95_ms"] = p95
+    return metrics
+
+# ------------------------------------------
+# Baselines and regression checks
+# ------------------------------------------
+def check_regressions(results, baseline, tolerance=0.25):
+    """
+    Compares {benchmark: {metric: value}} against a saved baseline of the same shape.
+    Metrics ending in "_ms" are timings and may be up to 'tolerance' slower; "_tokens" metrics
+    must not grow; all other metrics (hit rates, MRR) must not drop.
+    Returns a list of human-readable regressions (empty when the run is within bounds).
+    """
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            expected = baseline.get(name, {}).get(metric)
+            if expected is None:
+                continue
+            if metric.endswith("_ms"):
+                failed = value > expected * (1 + tolerance)
+            elif metric.endswith("_tokens"):
+                failed = value > expected
+            else:
+                failed = value < expected - 1e-9
+            if failed:
+                regressions.append(f"{name}.{metric}: {value:.4g} (baseline {expected:.4g})")
+    return regressions
+
+BENCHMARKS = {
+    "retrieval": bench_retrieval,
+    "embedding": bench_embedding,
+    "chunking": bench_chunking,
+    "hybrid": bench_hybrid,
+    "prompt": bench_prompt,
+    "ingestion": bench_ingestion,
+    "projection": bench_projection,
+    "store": bench_timecard_store,
+    "analytics": bench_analytics,
+    "reload": bench_reload,
+    "pipeline": bench_pipeline,
+    "conversation": bench_conversation,
+    "sessions": bench_sessions,
+}
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline performance benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help=f"any of: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--save", metavar="BASELINE", help="write the headline metrics to this JSON file")
+    parser.add_argument("--check", metavar="BASELINE", help="fail on a regression against this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown for timings (default 0.25)")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    results = {}
+    for name in args.benchmarks or list(BENCHMARKS):
+        results[name] = BENCHMARKS[name]() or {}
+        print()
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.check:
+        with open(args.check, "r", encoding="utf-8") as f:
+            regressions = check_regressions(results, json.load(f), tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
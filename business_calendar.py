@@ -0,0 +1,90 @@
+# business_calendar.py
+#
+# Business-day arithmetic with firm holidays, built on numpy's busday functions.
+# Every operation is O(1) per date and accepts whole arrays of dates / offsets.
+
+import numpy as np
+
+# Years covered by the default holiday list
+DEFAULT_HOLIDAY_YEARS = range(2000, 2101)
+
+def _observed(days):
+    # Saturday holidays are observed on Friday, Sunday holidays on Monday
+    weekday = (days.astype("datetime64[D]").view("int64") - 4) % 7  # 0 = Monday
+    return np.where(weekday == 5, days - 1, np.where(weekday == 6, days + 1, days))
+
+def firm_holidays(years=DEFAULT_HOLIDAY_YEARS):
+    """
+    Default firm holiday list: New Year's Day, Memorial Day, Independence Day, Labor Day,
+    Thanksgiving and the day after, and Christmas Day (fixed dates moved to the observed weekday).
+    """
+    years = np.asarray(list(years))
+    first_of = lambda month: np.array([f"{y}-{month:02d}-01" for y in years], dtype="datetime64[D]")
+    fixed = lambda month, day: first_of(month) + (day - 1)
+
+    thanksgiving = np.busday_offset(first_of(11), 3, roll="forward", weekmask="Thu")
+    holidays = np.concatenate([
+        _observed(fixed(1, 1)),
+        np.busday_offset(fixed(5, 31), 0, roll="backward", weekmask="Mon"),  # Memorial Day
+        _observed(fixed(7, 4)),
+        np.busday_offset(first_of(9), 0, roll="forward", weekmask="Mon"),    # Labor Day
+        thanksgiving,
+        thanksgiving + 1,
+        _observed(fixed(12, 25)),
+    ])
+    return np.unique(holidays)
+
+class BusinessCalendar:
+    """
+    Weekdays minus a configurable holiday list.
+    add_business_days / business_days_between take scalars or arrays (datetime.date,
+    numpy datetime64 or anything np.asarray can turn into datetime64[D]).
+    """
+
+    def __init__(self, holidays=None, weekmask="Mon Tue Wed Thu Fri"):
+        holidays = firm_holidays() if holidays is None else holidays
+        self.holidays = np.unique(np.asarray(holidays, dtype="datetime64[D]"))
+        self._calendar = np.busdaycalendar(weekmask=weekmask, holidays=self.holidays)
+
+    @classmethod
+    def from_knowledge_base(cls, knowledge_base):
+        """
+        Uses the optional top-level "firm_holidays" list (ISO dates) from knowledge_base.json,
+        falling back to the default firm holidays.
+        """
+        holidays = knowledge_base.get("firm_holidays")
+        return cls(holidays=holidays or None)
+
+    def add_business_days(self, start_dates, days_needed):
+        """
+        Moves each start date forward by 'days_needed' business days; the start itself
+        never counts, and a count of 0 returns the start unchanged. NaN counts give NaT.
+        Returns a datetime.date for scalar input, a datetime64[D] array otherwise.
+        """
+        scalar = np.ndim(start_dates) == 0 and np.ndim(days_needed) == 0
+        starts = np.asarray(start_dates, dtype="datetime64[D]")
+        days = np.asarray(days_needed, dtype=np.float64)
+        starts, days = np.broadcast_arrays(starts, days)
+        valid = ~np.isnan(days) & ~np.isnat(starts)
+        result = np.full(starts.shape, np.datetime64("NaT"), dtype="datetime64[D]")
+        counts = days[valid].astype(np.int64)
+        # roll='backward' makes a non-business start count the next business day as day 1
+        offset = np.busday_offset(starts[valid], counts, roll="backward", busdaycal=self._calendar)
+        result[valid] = np.where(counts == 0, starts[valid], offset)
+        if scalar:
+            return result.item() if valid.all() else None
+        return result
+
+    def business_days_between(self, start_dates, end_dates):
+        """
+        Number of business days after start and up to and including end
+        (the inverse of add_business_days).
+        """
+        starts = np.asarray(start_dates, dtype="datetime64[D]") + 1
+        ends = np.asarray(end_dates, dtype="datetime64[D]") + 1
+        return np.busday_count(starts, ends, busdaycal=self._calendar)
+
+    def is_business_day(self, dates):
+        return np.is_busday(np.asarray(dates, dtype="datetime64[D]"), busdaycal=self._calendar)
+
+DEFAULT_CALENDAR = BusinessCalendar()
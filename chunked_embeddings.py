@@ -1,8 +1,30 @@
 # chunked_embeddings.py
 
-import openai
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
 import numpy as np
 
+from embedding_client import BatchEmbeddingClient, count_tokens
+from llm_backend import get_backend
+from lexical_index import reciprocal_rank_fusion
+from prompt_builder import GPT_MODEL, count_message_tokens
+from tracing import annotate, record, span, traced
+
+logger = logging.getLogger(__name__)
+
+# Lexical confidence (see BM25Index.confidence) at which BM25 answers alone, skipping the query embedding.
+# Calibrated on the benchmark question set (python benchmarks.py hybrid).
+LEXICAL_FAST_PATH_CONFIDENCE = 0.3
+# Chunks taken from each ranking before fusion
+HYBRID_CANDIDATES = 10
+
+@traced()
 def split_text(text, chunk_size=300, overlap=50):
     """
     Splits 'text' into chunks of roughly 'chunk_size' words,
@@ -24,9 +46,13 @@ def split_text(text, chunk_size=300, overlap=50):
 
 def get_embedding(text, model="text-embedding-ada-002"):
     """
-    Returns the embedding vector for the given text using OpenAI's Embedding API.
+    Returns the embedding vector for the given text using OpenAI's Embedding API
+    (or the configured llm_backend).
     """
-    response = openai.Embedding.create(input=[text], model=model)
+    with span("get_embedding", model=model):
+        response = get_backend().embedding_create(input=[text], model=model)
+        usage = response.get('usage') or {}
+        record(api_calls=1, embedding_tokens=usage.get('total_tokens', 0))
     embedding = response['data'][0]['embedding']
     return embedding
 
@@ -38,26 +64,25 @@ def cosine_similarity(vec1, vec2):
     vec2 = np.array(vec2)
     return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
 
-def create_embeddings_for_chunks(chunks):
+@traced()
+def create_embeddings_for_chunks(chunks, client=None):
     """
     For each text chunk, compute its embedding and store both in a list.
+    Chunks are sent in token-bounded batches, several requests at a time (see BatchEmbeddingClient).
     Returns a list of dicts: [{ "chunk": chunk_text, "embedding": [...] }, ...]
     """
-    embeddings = []
-    for chunk in chunks:
-        emb = get_embedding(chunk)
-        embeddings.append({
-            "chunk": chunk,
-            "embedding": emb
-        })
-    return embeddings
+    client = client or BatchEmbeddingClient()
+    vectors = client.embed(chunks)
+    return [
+        {"chunk": chunk, "embedding": emb}
+        for chunk, emb in zip(chunks, vectors)
+    ]
 
-def find_top_n_chunks(query, embeddings, n=2):
+def rank_chunks(query_embedding, embeddings, n=2):
     """
-    Computes the embedding of 'query' and finds the top 'n' most similar chunks.
+    Scores every chunk against an already-computed query embedding, one cosine at a time.
     Returns a list of (similarity_score, chunk_text) sorted descending by score.
     """
-    query_embedding = get_embedding(query)
     scored = []
     for item in embeddings:
         similarity = cosine_similarity(query_embedding, item["embedding"])
@@ -65,14 +90,125 @@ def find_top_n_chunks(query, embeddings, n=2):
     scored.sort(key=lambda x: x[0], reverse=True)
     return scored[:n]
 
-def ask_gpt(query, combined_chunks):
+@traced()
+def lexical_fast_path(query, lexical_index, n=2, fast_path_confidence=LEXICAL_FAST_PATH_CONFIDENCE,
+                      candidates=HYBRID_CANDIDATES):
     """
-    Calls GPT using a prompt that instructs it to answer ONLY with the provided chunks.
-    combined_chunks is a string that merges the top N chunks.
+    True when find_top_n_chunks (same arguments) answers 'query' from BM25 alone, i.e. without embedding it.
     """
-    if not combined_chunks.strip():
-        return "I don't have information on that."
+    if lexical_index is None or fast_path_confidence is None:
+        return False
+    lexical = lexical_index.search(query, k=max(n, candidates))
+    return lexical_index.confidence(query, lexical) >= fast_path_confidence
+
+def find_top_n_chunks(query, embeddings, n=2, cache=None, lexical_index=None,
+                      fast_path_confidence=LEXICAL_FAST_PATH_CONFIDENCE, candidates=HYBRID_CANDIDATES):
+    """
+    Computes the embedding of 'query' and finds the top 'n' most similar chunks.
+    'embeddings' is either the list of dicts from create_embeddings_for_chunks or a ChunkRetriever.
+    If a QueryCache is given, the query embedding is looked up there first.
+    With a BM25Index as 'lexical_index', the lexical and embedding rankings are fused
+    (reciprocal_rank_fusion); when the lexical confidence reaches 'fast_path_confidence'
+    (None disables this), the BM25 ranking is returned without embedding the query.
+    Returns a list of (score, chunk_text) sorted descending by score.
+    """
+    lexical = None
+    if lexical_index is not None:
+        lexical = lexical_index.search(query, k=max(n, candidates))
+        confidence = lexical_index.confidence(query, lexical)
+        if fast_path_confidence is not None and confidence >= fast_path_confidence:
+            logger.info("find_top_n_chunks: lexical fast path (confidence=%.2f)", confidence)
+            annotate(path="lexical", lexical_confidence=round(confidence, 3))
+            return lexical[:n]
+
+    query_embedding = cache.get_embedding(query) if cache is not None else get_embedding(query)
+    k = n if lexical is None else max(n, candidates)
+    if isinstance(embeddings, ChunkRetriever):
+        vector = embeddings.search(query_embedding, k=k)
+    else:
+        vector = rank_chunks(query_embedding, embeddings, n=k)
+    if lexical is None:
+        annotate(path="vector")
+        return vector
+    annotate(path="hybrid", lexical_confidence=round(confidence, 3))
+    return reciprocal_rank_fusion([vector, lexical], n=n)
+
+class ChunkRetriever:
+    """
+    Vectorized top-k retrieval over a pre-normalized float32 matrix of chunk embeddings.
+    A query is scored with one matrix-vector product and the top k are picked with
+    argpartition, so no per-chunk Python work happens at query time.
+    The matrix is read-only, so one retriever can serve concurrent sessions; an already
+    normalized (e.g. memory-mapped ada-002) matrix is used without a copy.
+    """
+
+    def __init__(self, chunks, embedding_matrix):
+        matrix = np.asarray(embedding_matrix, dtype=np.float32)
+        if matrix.size == 0:
+            matrix = matrix.reshape(len(chunks), 0)
+        if matrix.ndim != 2 or len(matrix) != len(chunks):
+            raise ValueError("embedding_matrix must have one row per chunk")
+        self.chunks = list(chunks)
+        # A read-only view: the caller's array stays writable, this one cannot change under a query
+        self.matrix = _normalize_rows(matrix).view()
+        self.matrix.flags.writeable = False
+
+    @classmethod
+    def from_embeddings(cls, embeddings):
+        """
+        Builds a retriever from the [{ "chunk": ..., "embedding": [...] }, ...] list.
+        """
+        return cls(
+            [item["chunk"] for item in embeddings],
+            [item["embedding"] for item in embeddings]
+        )
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def top_k(self, query_embeddings, k=2):
+        """
+        Scores a (d,) query or a (m, d) batch of queries against every chunk.
+        Returns (indices, scores), both shaped (m, k) and sorted descending by score.
+        """
+        queries = _normalize_rows(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        k = min(k, len(self.chunks))
+        if k <= 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.intp), empty.astype(np.float32)
+        scores = queries @ self.matrix.T
+        if k < scores.shape[1]:
+            indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            indices = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+        top_scores = np.take_along_axis(scores, indices, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(indices, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def search(self, query_embedding, k=2):
+        """
+        Returns a list of (similarity_score, chunk_text) for one query embedding.
+        """
+        return self.search_batch([query_embedding], k=k)[0]
+
+    def search_batch(self, query_embeddings, k=2):
+        """
+        Returns one list of (similarity_score, chunk_text) per query embedding.
+        """
+        indices, scores = self.top_k(query_embeddings, k=k)
+        return [
+            [(float(score), self.chunks[i]) for i, score in zip(row_indices, row_scores)]
+            for row_indices, row_scores in zip(indices, scores)
+        ]
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    if np.allclose(norms, 1.0, atol=1e-5):
+        return matrix
+    norms[norms == 0] = 1.0
+    return matrix / norms
 
+def _build_gpt_messages(query, combined_chunks):
     # More direct instructions for GPT
     system_msg = (
         "You are an AI assistant. Your answers must be factual, concise, and well-structured. "
@@ -89,15 +225,227 @@ def ask_gpt(query, combined_chunks):
         f"User's question: {query}\n\n"
         "Answer in short, structured paragraphs or bullet points:\n"
     )
+    return [
+        {"role": "system", "content": system_msg},
+        {"role": "user", "content": user_prompt}
+    ]
 
-    response = openai.ChatCompletion.create(
-        model="gpt-4",  # If you have GPT-4 access; else "gpt-3.5-turbo"
-        messages=[
-            {"role": "system", "content": system_msg},
-            {"role": "user", "content": user_prompt}
-        ],
+@traced(model=GPT_MODEL)
+def ask_gpt(query, combined_chunks):
+    """
+    Calls GPT using a prompt that instructs it to answer ONLY with the provided chunks.
+    combined_chunks is a string that merges the top N chunks (see prompt_builder.build_context).
+    Prompt and completion token counts are logged per call.
+    """
+    if not combined_chunks.strip():
+        return "I don't have information on that."
+
+    messages = _build_gpt_messages(query, combined_chunks)
+    response = get_backend().chat_completion_create(
+        model=GPT_MODEL,  # If you have GPT-4 access; else "gpt-3.5-turbo"
+        messages=messages,
         temperature=0.3,  # Adjust for more or less creativity
         max_tokens=500
     )
     answer = response['choices'][0]['message']['content']
+    usage = response.get('usage') or {}
+    prompt_tokens = usage.get('prompt_tokens', count_message_tokens(messages))
+    completion_tokens = usage.get('completion_tokens', count_tokens(answer, model=GPT_MODEL))
+    record(api_calls=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    logger.info("ask_gpt: prompt_tokens=%d completion_tokens=%d", prompt_tokens, completion_tokens)
     return answer
+
+def ask_gpt_stream(query, combined_chunks):
+    """
+    Streaming variant of ask_gpt: yields the answer text piece by piece as it arrives.
+    Time-to-first-token and total time are logged separately, with the prompt and completion
+    token counts (counted locally: streamed responses carry no usage block).
+    """
+    if not combined_chunks.strip():
+        yield "I don't have information on that."
+        return
+
+    with span("ask_gpt_stream", model=GPT_MODEL) as stream_span:
+        start = time.perf_counter()
+        first_token_at = None
+        messages = _build_gpt_messages(query, combined_chunks)
+        pieces = []
+        response = get_backend().chat_completion_create(
+            model=GPT_MODEL,
+            messages=messages,
+            temperature=0.3,
+            max_tokens=500,
+            stream=True
+        )
+        for chunk in response:
+            piece = chunk['choices'][0].get('delta', {}).get('content')
+            if not piece:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            pieces.append(piece)
+            yield piece
+        end = time.perf_counter()
+        prompt_tokens = count_message_tokens(messages)
+        completion_tokens = count_tokens("".join(pieces), model=GPT_MODEL)
+        record(api_calls=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        stream_span.set(time_to_first_token_ms=round(((first_token_at or end) - start) * 1000, 3))
+        logger.info(
+            "ask_gpt_stream: time_to_first_token=%.3fs total=%.3fs prompt_tokens=%d completion_tokens=%d",
+            (first_token_at or end) - start, end - start, prompt_tokens, completion_tokens
+        )
+
+# ------------------------------------------
+# Query caches (query -> embedding, query + chunks -> answer)
+# ------------------------------------------
+_MISSING = object()
+
+class LRUTTLCache:
+    """
+    Thread-safe, size-bounded LRU cache whose entries expire after 'ttl' seconds.
+    With 'disk_path', entries are also written to a SQLite file and survive restarts;
+    values must then be JSON-serializable.
+    """
+
+    def __init__(self, maxsize=256, ttl=3600, disk_path=None, namespace="default"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(namespace TEXT, key TEXT, value TEXT, created REAL, PRIMARY KEY (namespace, key))"
+            )
+            self._db.commit()
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING and self._db is not None:
+                entry = self._load(key)
+                if entry is not _MISSING:
+                    self._data[key] = entry
+                    self._trim()
+            if entry is not _MISSING and now - entry[1] <= self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not _MISSING:
+                self._evict(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        entry = (value, time.time())
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            self._trim()
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value), entry[1])
+                )
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def _load(self, key):
+        row = self._db.execute(
+            "SELECT value, created FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, key)
+        ).fetchone()
+        if row is None:
+            return _MISSING
+        return json.loads(row[0]), row[1]
+
+    def _trim(self):
+        while len(self._data) > self.maxsize:
+            oldest, _ = self._data.popitem(last=False)
+            self._delete(oldest)
+
+    def _evict(self, key):
+        self._data.pop(key, None)
+        self._delete(key)
+
+    def _delete(self, key):
+        if self._db is not None:
+            self._db.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+            self._db.commit()
+
+def normalize_query(query):
+    """
+    Lower-cases, collapses whitespace and strips trailing punctuation so that
+    trivially different phrasings of the same question share cache entries.
+    """
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+def _chunk_id(chunk):
+    return hashlib.sha1(chunk.encode("utf-8")).hexdigest()[:16]
+
+class QueryCache:
+    """
+    Two-level cache for repeated questions:
+      - embedding model (as identified by the backend) + normalized query text -> query embedding
+        (skips get_embedding; vectors of another model or backend are never served, also not from disk)
+      - normalized query + retrieved chunk IDs -> final ask_gpt answer (skips the GPT call)
+    The answer key includes the chunks, so a changed knowledge base never serves a stale answer.
+    """
+
+    def __init__(self, maxsize=512, ttl=24 * 3600, disk_path=None):
+        self.embeddings = LRUTTLCache(maxsize=maxsize, ttl=ttl, disk_path=disk_path, namespace="embedding")
+        self.answers = LRUTTLCache(maxsize=maxsize, ttl=ttl, disk_path=disk_path, namespace="answer")
+
+    def get_embedding(self, query, embed_fn=None, model="text-embedding-ada-002"):
+        # 'embed_fn', if given, must embed with 'model'
+        key = get_backend().model_id(model) + "|" + normalize_query(query)
+        embedding = self.embeddings.get(key)
+        if embedding is None:
+            embedding = embed_fn(query) if embed_fn is not None else get_embedding(query, model=model)
+            self.embeddings.set(key, list(map(float, embedding)))
+        return embedding
+
+    def lookup_answer(self, query, chunks):
+        return self.answers.get(self._answer_key(query, chunks))
+
+    def store_answer(self, query, chunks, answer):
+        self.answers.set(self._answer_key(query, chunks), answer)
+
+    def get_answer(self, query, chunks, compute_fn):
+        """
+        Returns the cached answer for (query, chunks), calling compute_fn() on a miss.
+        """
+        answer = self.lookup_answer(query, chunks)
+        if answer is None:
+            answer = compute_fn()
+            self.store_answer(query, chunks, answer)
+        return answer
+
+    @staticmethod
+    def _answer_key(query, chunks):
+        return normalize_query(query) + "|" + ",".join(_chunk_id(chunk) for chunk in chunks)
+
+    def stats(self):
+        return {"embedding": self.embeddings.stats(), "answer": self.answers.stats()}
@@ -0,0 +1,163 @@
+# conversation_store.py
+#
+# Bounded per-session conversation history.
+# Only the last 'window' messages stay in memory; older ones are folded into a short
+# summary (the questions asked, newest kept), so session memory stays flat however long
+# the conversation runs. With a SQLite file, every message is also written to disk and
+# the full history can still be paged through.
+
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+SYSTEM_PROMPT = (
+    "You are an AI assistant that ONLY answers based on the provided knowledge base. "
+    "If the answer is not in the knowledge base, reply with: 'I don't have information on that.'"
+)
+# Messages kept in memory (a question and its answer are two messages)
+DEFAULT_WINDOW = 20
+# Earlier questions listed in the summary, and the length each is cut to
+SUMMARY_MAX_QUESTIONS = 10
+SUMMARY_QUESTION_CHARS = 80
+DEFAULT_PAGE_SIZE = 10
+
+class ConversationStore:
+    """
+    The system prompt, the last 'window' messages and a summary of everything older.
+    With 'db_path', all messages are also appended to a SQLite file, and page() reads
+    from it instead of from memory.
+    """
+
+    def __init__(self, system_prompt=SYSTEM_PROMPT, window=DEFAULT_WINDOW, db_path=None):
+        self.system_prompt = system_prompt
+        self.window = window
+        self.messages = deque()
+        self.compacted = 0
+        self._earlier_questions = deque(maxlen=SUMMARY_MAX_QUESTIONS)
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS messages "
+                "(seq INTEGER PRIMARY KEY AUTOINCREMENT, role TEXT, content TEXT, created REAL)"
+            )
+            self._db.commit()
+            self._restore()
+
+    def __len__(self):
+        # Messages in the whole conversation, including the compacted ones
+        return self.compacted + len(self.messages)
+
+    @property
+    def persistent(self):
+        return self._db is not None
+
+    def append(self, role, content):
+        message = {"role": role, "content": content}
+        with self._lock:
+            self.messages.append(message)
+            while len(self.messages) > self.window:
+                self._compact(self.messages.popleft())
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT INTO messages (role, content, created) VALUES (?, ?, ?)", (role, content, time.time())
+                )
+                self._db.commit()
+        return message
+
+    def _compact(self, message):
+        self.compacted += 1
+        if message["role"] == "user":
+            question = " ".join(message["content"].split())
+            if len(question) > SUMMARY_QUESTION_CHARS:
+                question = question[:SUMMARY_QUESTION_CHARS - 3].rstrip() + "..."
+            self._earlier_questions.append(question)
+
+    def summary(self):
+        """
+        One line describing the compacted messages ("" while nothing has been compacted).
+        """
+        if not self.compacted:
+            return ""
+        questions = "; ".join(self._earlier_questions)
+        return f"{self.compacted} earlier messages. Most recent earlier questions: {questions}" if questions \
+            else f"{self.compacted} earlier messages."
+
+    def context_messages(self):
+        """
+        Messages for a chat request: the system prompt, the summary (if any) and the window.
+        """
+        context = [{"role": "system", "content": self.system_prompt}]
+        summary = self.summary()
+        if summary:
+            context.append({"role": "system", "content": f"Conversation so far: {summary}"})
+        return context + list(self.messages)
+
+    def latest(self, role="assistant"):
+        """
+        The content of the most recent message from 'role', or None.
+        """
+        for message in reversed(self.messages):
+            if message["role"] == role:
+                return message["content"]
+        return None
+
+    def page_count(self, page_size=DEFAULT_PAGE_SIZE):
+        return max(1, -(-self._pageable_count() // page_size))
+
+    def page(self, number=1, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Messages on page 'number' (1 = newest), oldest first within the page.
+        Without a SQLite file only the in-memory window can be paged.
+        """
+        offset = (number - 1) * page_size
+        if self._db is not None:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT role, content FROM messages ORDER BY seq DESC LIMIT ? OFFSET ?", (page_size, offset)
+                ).fetchall()
+            return [{"role": role, "content": content} for role, content in reversed(rows)]
+        with self._lock:
+            newest_first = list(reversed(self.messages))[offset:offset + page_size]
+        return newest_first[::-1]
+
+    def _pageable_count(self):
+        if self._db is not None:
+            with self._lock:
+                return self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return len(self.messages)
+
+    def _restore(self):
+        # Rebuild the window and summary from an existing file (e.g. after a server restart)
+        total = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        older = max(total - self.window, 0)
+        for role, content in self._db.execute(
+            "SELECT role, content FROM messages WHERE role = 'user' AND seq IN "
+            "(SELECT seq FROM messages ORDER BY seq LIMIT ?) ORDER BY seq DESC LIMIT ?",
+            (older, SUMMARY_MAX_QUESTIONS)
+        ).fetchall()[::-1]:
+            self._compact({"role": role, "content": content})
+        self.compacted = older
+        rows = self._db.execute(
+            "SELECT role, content FROM messages ORDER BY seq DESC LIMIT ?", (self.window,)
+        ).fetchall()
+        self.messages.extend({"role": role, "content": content} for role, content in reversed(rows))
+
+    def clear(self):
+        with self._lock:
+            self.messages.clear()
+            self._earlier_questions.clear()
+            self.compacted = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM messages")
+                self._db.commit()
+
+def session_db_path(directory, session_id):
+    """
+    Path of the SQLite file holding one session's conversation; the directory is created if needed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{session_id}.sqlite3")
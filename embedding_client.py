@@ -0,0 +1,147 @@
+# embedding_client.py
+#
+# Batched, concurrent embedding requests with backoff on rate limits.
+# Many chunks are packed into each Embedding API request (bounded by a tiktoken count),
+# batches run on a small thread pool, and results come back in the original order.
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import openai
+
+from tracing import in_current_span, record
+
+DEFAULT_MODEL = "text-embedding-ada-002"
+
+@lru_cache(maxsize=None)
+def _get_encoding(model):
+    import tiktoken
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # tiktoken downloads its BPE files on first use; offline we fall back to an estimate
+        return None
+
+def count_tokens(text, model=DEFAULT_MODEL):
+    """
+    Returns the number of tokens 'text' uses for 'model'.
+    Falls back to a ~4 characters per token estimate when the tiktoken encoding is unavailable.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def _backend_create(**kwargs):
+    # Looked up on every call so set_backend() / a replaced openai.Embedding.create is honoured
+    from llm_backend import get_backend
+    return get_backend().embedding_create(**kwargs)
+
+def _retry_after_seconds(error):
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class BatchEmbeddingClient:
+    """
+    Embeds lists of texts using as few requests as possible, several at a time.
+
+    'create_fn' has the signature of openai.Embedding.create(input=[...], model=...) and
+    returns {"data": [{"index": i, "embedding": [...]}, ...]}; pass a fake to run offline.
+    """
+
+    RETRYABLE_ERRORS = (
+        openai.error.RateLimitError,
+        openai.error.ServiceUnavailableError,
+        openai.error.APIConnectionError,
+        openai.error.Timeout,
+    )
+
+    def __init__(self, model=DEFAULT_MODEL, create_fn=None, max_batch_tokens=50_000,
+                 max_batch_size=256, max_workers=4, max_retries=6, base_delay=1.0, max_delay=30.0):
+        self.model = model
+        self.create_fn = create_fn or _backend_create
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.request_count = 0
+        self.retry_count = 0
+        self._lock = threading.Lock()
+
+    def make_batches(self, texts):
+        """
+        Groups text positions into batches that respect max_batch_tokens and max_batch_size.
+        A single text larger than the token budget still gets a batch of its own.
+        """
+        batches = []
+        current, current_tokens = [], 0
+        for i, text in enumerate(texts):
+            tokens = count_tokens(text, self.model)
+            if current and (current_tokens + tokens > self.max_batch_tokens or len(current) >= self.max_batch_size):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def embed(self, texts):
+        """
+        Returns one embedding per text, in the same order as 'texts'.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        batches = self.make_batches(texts)
+        results = [None] * len(texts)
+
+        def run(batch):
+            vectors = self._embed_batch([texts[i] for i in batch])
+            for i, vector in zip(batch, vectors):
+                results[i] = vector
+
+        if len(batches) == 1 or self.max_workers <= 1:
+            for batch in batches:
+                run(batch)
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+                # list() re-raises the first failure from any worker
+                list(pool.map(in_current_span(run), batches))
+        return results
+
+    def _embed_batch(self, batch_texts):
+        attempt = 0
+        while True:
+            try:
+                with self._lock:
+                    self.request_count += 1
+                record(api_calls=1)
+                response = self.create_fn(input=batch_texts, model=self.model)
+                break
+            except self.RETRYABLE_ERRORS as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                with self._lock:
+                    self.retry_count += 1
+                record(retries=1)
+                delay = _retry_after_seconds(e)
+                if delay is None:
+                    delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+                    delay *= random.uniform(0.5, 1.0)
+                time.sleep(delay)
+        record(embedding_tokens=(response.get("usage") or {}).get("total_tokens", 0))
+        data = sorted(response["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
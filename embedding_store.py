@@ -0,0 +1,207 @@
+# embedding_store.py
+#
+# Content-addressed, on-disk embedding index for the knowledge base.
+# Build it once (at app startup or with `python embedding_store.py`) and reuse it
+# for every query, so a question only costs one embedding call for the query itself.
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from chunked_embeddings import split_text, ChunkRetriever
+from embedding_client import BatchEmbeddingClient, DEFAULT_MODEL
+from llm_backend import get_backend
+
+DEFAULT_INDEX_DIR = ".embedding_index"
+MANIFEST_FILE = "manifest.json"
+# Matrix of indexes saved before the manifest named its matrix file
+MATRIX_FILE = "embeddings.npy"
+MATRIX_PREFIX = "embeddings"
+# Unreferenced matrix files younger than this may belong to a save still in progress
+STALE_MATRIX_SECONDS = 600
+# A save in another process can remove the matrix a just-read manifest names; read again
+LOAD_ATTEMPTS = 3
+
+def chunk_key(chunk, model, chunk_size, overlap):
+    """
+    Returns a stable hash for a chunk, its embedding model and the chunking parameters.
+    Any change to one of them produces a different key (and therefore a re-embed).
+    """
+    payload = f"{model}\x1f{chunk_size}\x1f{overlap}\x1f{chunk}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class EmbeddingStore:
+    """
+    Keeps chunk embeddings in '<index_dir>/embeddings-<unique>.npy' (one float32 row per
+    chunk) next to '<index_dir>/manifest.json', which names that file and records the key
+    and text of each row. A save writes a new matrix file and then replaces only the
+    manifest, so readers (threads or processes) always get a matching pair.
+    With mmap=True the matrix is memory-mapped read-only, so every process serving the
+    same index shares one copy of it in the page cache.
+    """
+
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR, model=DEFAULT_MODEL, client=None, mmap=False):
+        self.index_dir = index_dir
+        self.model = model
+        self.mmap = mmap
+        # Stored with the index; equals 'model' for OpenAI, so a fake backend gets its own keys
+        self.model_id = get_backend().model_id(model)
+        self.client = client or BatchEmbeddingClient(model=model)
+        self.keys = []
+        self.chunks = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.matrix_file = None
+        self.last_embedded_count = 0
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.index_dir, MANIFEST_FILE)
+
+    @property
+    def matrix_path(self):
+        return os.path.join(self.index_dir, self.matrix_file or MATRIX_FILE)
+
+    def load(self):
+        """
+        Loads the index from disk if present. A missing or unreadable index is treated as empty.
+        """
+        for _ in range(LOAD_ATTEMPTS):
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                self.matrix_file = os.path.basename(manifest.get("matrix", MATRIX_FILE))
+                matrix = self._load_matrix()
+                break
+            except FileNotFoundError:
+                # No index yet, or the matrix was replaced after the manifest was read
+                if not os.path.exists(self.manifest_path):
+                    return self
+            except (ValueError, OSError):
+                return self
+        else:
+            return self
+        if manifest.get("model") != self.model_id or len(manifest.get("keys", [])) != len(matrix):
+            return self
+        self.keys = manifest["keys"]
+        self.chunks = manifest["chunks"]
+        self.matrix = matrix.astype(np.float32, copy=False)
+        return self
+
+    def _load_matrix(self):
+        return np.load(self.matrix_path, mmap_mode="r" if self.mmap else None)
+
+    def build(self, chunks, chunk_size, overlap):
+        """
+        Makes the index match 'chunks'. Rows whose key is already stored are reused;
+        only new or changed chunks are sent to the Embedding API, in batches.
+        Rows for chunks that disappeared are dropped. The index is saved when anything changed.
+        """
+        new_keys = [chunk_key(chunk, self.model_id, chunk_size, overlap) for chunk in chunks]
+        if new_keys == self.keys and len(self.matrix) == len(new_keys):
+            # Unchanged index: keep the loaded (possibly memory-mapped) matrix as it is
+            self.chunks = list(chunks)
+            self.last_embedded_count = 0
+            return self
+        existing = {key: i for i, key in enumerate(self.keys)}
+
+        missing = [i for i, key in enumerate(new_keys) if key not in existing]
+        fresh = dict(zip(missing, self.client.embed([chunks[i] for i in missing])))
+        rows = [
+            np.asarray(fresh[i], dtype=np.float32) if i in fresh else self.matrix[existing[key]]
+            for i, key in enumerate(new_keys)
+        ]
+        embedded = len(missing)
+
+        changed = embedded > 0 or new_keys != self.keys
+        self.keys = new_keys
+        self.chunks = list(chunks)
+        self.matrix = np.vstack(rows) if rows else np.zeros((0, 0), dtype=np.float32)
+        self.last_embedded_count = embedded
+        if changed:
+            self.save()
+            if self.mmap and len(self.matrix):
+                try:
+                    self.matrix = self._load_matrix()
+                except FileNotFoundError:
+                    # Already superseded and removed by another process: keep the rows in memory
+                    pass
+        return self
+
+    def save(self):
+        """
+        Writes the matrix to a new, uniquely named file, then points the manifest at it with
+        one os.replace, so concurrent savers never share a temp file and readers never pair a
+        matrix with another save's manifest. Matrix files no longer referenced are removed
+        once they are STALE_MATRIX_SECONDS old.
+        """
+        os.makedirs(self.index_dir, exist_ok=True)
+        fd, matrix_path = tempfile.mkstemp(prefix=MATRIX_PREFIX + "-", suffix=".npy", dir=self.index_dir)
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, self.matrix)
+        matrix_file = os.path.basename(matrix_path)
+        fd, tmp_manifest = tempfile.mkstemp(prefix=MANIFEST_FILE + ".", suffix=".tmp", dir=self.index_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_id, "matrix": matrix_file, "keys": self.keys, "chunks": self.chunks}, f)
+        os.replace(tmp_manifest, self.manifest_path)
+        self.matrix_file = matrix_file
+        self._remove_stale_matrices()
+
+    def _remove_stale_matrices(self):
+        # Memory-mapped readers keep a removed file's pages; new readers follow the manifest
+        now = time.time()
+        for name in os.listdir(self.index_dir):
+            # Old matrices, and temp files of saves that never finished
+            if not (name.startswith(MATRIX_PREFIX) or name.endswith(".tmp")) or name == self.matrix_file:
+                continue
+            path = os.path.join(self.index_dir, name)
+            try:
+                if now - os.path.getmtime(path) >= STALE_MATRIX_SECONDS:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def as_chunk_embeddings(self):
+        """
+        Returns the index in the [{ "chunk": ..., "embedding": ... }, ...] shape used by find_top_n_chunks.
+        """
+        return [
+            {"chunk": chunk, "embedding": row}
+            for chunk, row in zip(self.chunks, self.matrix)
+        ]
+
+    def retriever(self):
+        """
+        Returns a ChunkRetriever over the stored matrix for vectorized top-k search.
+        """
+        return ChunkRetriever(self.chunks, self.matrix)
+
+def build_store(chunks, chunk_size, overlap=0, index_dir=DEFAULT_INDEX_DIR, model=DEFAULT_MODEL, client=None, mmap=False):
+    """
+    Brings the on-disk index up to date with 'chunks' (a list of chunk texts).
+    'chunk_size' / 'overlap' describe how the chunks were produced and are part of each key.
+    """
+    store = EmbeddingStore(index_dir=index_dir, model=model, client=client, mmap=mmap).load()
+    return store.build(chunks, chunk_size=chunk_size, overlap=overlap)
+
+def build_store_from_text(knowledge_text, chunk_size=300, overlap=50,
+                          index_dir=DEFAULT_INDEX_DIR, model=DEFAULT_MODEL, client=None):
+    """
+    Chunks 'knowledge_text' with split_text and brings the on-disk index up to date with it.
+    """
+    chunks = split_text(knowledge_text, chunk_size=chunk_size, overlap=overlap) if knowledge_text.strip() else []
+    return build_store(chunks, chunk_size, overlap, index_dir=index_dir, model=model, client=client)
+
+if __name__ == "__main__":
+    # CLI: python embedding_store.py [knowledge_base.json]
+    # Reads OPENAI_API_KEY from the environment.
+    from kb_loader import KNOWLEDGE_BASE_PATH, DEFAULT_CHUNK_TOKENS, read_knowledge_base, chunk_knowledge_base
+
+    kb_path = sys.argv[1] if len(sys.argv) > 1 else KNOWLEDGE_BASE_PATH
+    kb_chunks = chunk_knowledge_base(read_knowledge_base(kb_path), max_tokens=DEFAULT_CHUNK_TOKENS)
+    store = build_store([c["text"] for c in kb_chunks], chunk_size=DEFAULT_CHUNK_TOKENS)
+    print(f"Indexed {len(store.chunks)} chunks ({store.last_embedded_count} embedded) into {store.index_dir}/")
@@ -0,0 +1,282 @@
+# excel_analytics.py
+#
+# Query engine behind answer_excel_question and the projection view's offender table.
+# Aggregates are built once per upload (TimecardAnalytics); each question then only
+# slices small precomputed tables.
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from projection import TARGET_AVERAGE
+
+WDD = "Weighted Date Diff"
+HOURS = "Hours Worked"
+DAYS = "Days To Enter Time"
+
+ENTRY_COLUMNS = [
+    "Timecard Index",
+    "Client Name",
+    "Matter Number",
+    "Work Date",
+    "TimeCard Entry Date",
+    "Days To Enter Time",
+    "Hours Worked",
+    "Weighted Date Diff"
+]
+
+DEFAULT_TOP_N = 5
+# Entries kept in each precomputed ranking; answer() never asks for more
+TOP_K = 100
+# Per-entry contributions are small fractions of a day
+DECIMALS = {"Contribution": 4, "Excess Contribution": 4}
+
+def markdown_table(df, decimals=2):
+    """
+    Renders a small DataFrame as a GitHub-flavored markdown table.
+    """
+    def fmt(value, col):
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            return ""
+        if isinstance(value, (float, np.floating)):
+            return f"{value:.{DECIMALS.get(col, decimals)}f}"
+        if isinstance(value, pd.Timestamp):
+            return value.strftime('%m/%d/%Y')
+        return str(value)
+
+    columns = list(df.columns)
+    header = "| " + " | ".join(str(c) for c in columns) + " |"
+    divider = "| " + " | ".join("---" for _ in columns) + " |"
+    rows = [
+        "| " + " | ".join(fmt(v, col) for v, col in zip(row, columns)) + " |"
+        for row in df.itertuples(index=False)
+    ]
+    return "\n".join([header, divider] + rows)
+
+class TimecardAnalytics:
+    """
+    Precomputed, typed aggregates over one cleaned timecard export: the top 'top_k' entries
+    (overall, by excess contribution, and per client / matter), and client, matter, week and
+    month breakdowns. Built once per upload; queries only slice these, never the full frame.
+    """
+
+    def __init__(self, df, top_k=TOP_K):
+        # Shallow copy: the typed / derived columns below are added without touching the caller's frame
+        df = df.copy(deep=False)
+        for col in (WDD, HOURS, DAYS):
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors="coerce")
+        if "Work Date" in df.columns:
+            df["Work Date"] = pd.to_datetime(df["Work Date"], errors="coerce")
+
+        self.total_weighted = float(df[WDD].sum()) if WDD in df.columns else 0.0
+        self.total_hours = float(df[HOURS].sum()) if HOURS in df.columns else 0.0
+        self.average = self.total_weighted / self.total_hours if self.total_hours else 0.0
+        self.entry_count = len(df)
+        self.top_k = top_k
+
+        # Each entry's share of the weighted average, and how far it pushes it above the target
+        if WDD in df.columns and HOURS in df.columns and self.total_hours:
+            df["Contribution"] = df[WDD] / self.total_hours
+            df["Excess Contribution"] = (df[WDD] - TARGET_AVERAGE * df[HOURS]) / self.total_hours
+
+        self.frame = df
+        self.entry_columns = [c for c in ENTRY_COLUMNS + ["Contribution", "Excess Contribution"] if c in df.columns]
+        # Row positions of the top / bottom entries, selected once (nlargest, not a full sort)
+        self._worst = self._top_positions(WDD, top_k)
+        self._best = self._top_positions(WDD, top_k, largest=False)
+        self._contribution = (
+            self._top_positions("Excess Contribution", top_k) if "Excess Contribution" in df.columns else self._worst
+        )
+        self.by_group, self._group_worst = {}, {}
+        for dim, col in (("client", "Client Name"), ("matter", "Matter Number")):
+            if col in df.columns:
+                self.by_group[dim] = self._group(df, col)
+                self._group_worst[dim] = self._group_top(df, col, top_k)
+        has_dates = "Work Date" in df.columns and DAYS in df.columns
+        self.by_week = self._by_period(df, "W-SUN", "Week Of") if has_dates else None
+        self.by_month = self._by_period(df, "M", "Month Of") if has_dates else None
+        self._timecard_lookup = None
+        if "Timecard Index" in df.columns:
+            lookup = pd.Series(np.arange(len(df)), index=df["Timecard Index"].astype("string").to_numpy())
+            self._timecard_lookup = lookup[~lookup.index.duplicated()]
+
+    def _top_positions(self, col, k, largest=True):
+        # Positions of the k largest values of 'col' (ties in row order), or of the k smallest
+        # (ties in reverse row order: the largest ranking read backwards). NaN is skipped.
+        if col not in self.frame.columns:
+            return np.arange(min(k, len(self.frame)))
+        values = pd.Series(self.frame[col].to_numpy())
+        ranked = values.nlargest(k) if largest else values.nsmallest(k, keep="last")
+        return ranked.index.to_numpy()
+
+    def _group_top(self, df, col, k):
+        # {str(group): positions of its k worst entries by Weighted Date Diff}, from one lexsort
+        if WDD not in df.columns:
+            return {}
+        groups = df[col].astype("category")
+        codes = groups.cat.codes.to_numpy()
+        order = np.lexsort((-df[WDD].fillna(-np.inf).to_numpy(), codes))
+        order = order[codes[order] >= 0]
+        if not len(order):
+            return {}
+        sorted_codes = codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+        order, sorted_codes = order[rank < k], sorted_codes[rank < k]
+        bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+        categories = groups.cat.categories
+        return {
+            str(categories[code]): positions
+            for code, positions in zip(sorted_codes[np.r_[0, bounds]], np.split(order, bounds))
+        }
+
+    def _group(self, df, col):
+        agg = {"Entries": (WDD, "size"), "Hours": (HOURS, "sum"), "Weighted": (WDD, "sum")}
+        if "Excess Contribution" in df.columns:
+            agg["Excess Contribution"] = ("Excess Contribution", "sum")
+        grouped = df.groupby(col, observed=True).agg(**agg)
+        grouped["Average Days"] = grouped["Weighted"] / grouped["Hours"].where(grouped["Hours"] != 0)
+        return grouped.reset_index()
+
+    def _by_period(self, df, freq, label):
+        period = df["Work Date"].dt.to_period(freq).dt.start_time
+        grouped = df.groupby(period).agg(
+            Entries=(DAYS, "size"),
+            Hours=(HOURS, "sum"),
+            Weighted=(WDD, "sum"),
+            Median_Delay=(DAYS, "median"),
+            Max_Delay=(DAYS, "max"),
+        )
+        grouped["Average Days"] = grouped["Weighted"] / grouped["Hours"].where(grouped["Hours"] != 0)
+        grouped.index.name = label
+        return grouped.reset_index().rename(columns={"Median_Delay": "Median Delay", "Max_Delay": "Max Delay"})
+
+    def _rows(self, positions, columns=None):
+        columns = [c for c in columns if c in self.frame.columns] if columns else self.entry_columns
+        return self.frame.iloc[positions][columns]
+
+    # ------------------------------------------
+    # Queries (all served from the precomputed tables)
+    # ------------------------------------------
+    def worst_entries(self, n=DEFAULT_TOP_N, columns=None):
+        positions = self._worst[:n] if n <= self.top_k else self._top_positions(WDD, n)
+        return self._rows(positions, columns)
+
+    def best_entries(self, n=DEFAULT_TOP_N, columns=None):
+        positions = self._best[:n] if n <= self.top_k else self._top_positions(WDD, n, largest=False)
+        return self._rows(positions, columns)
+
+    def ranked_groups(self, dim, n=DEFAULT_TOP_N, worst=True):
+        table = self.by_group[dim]
+        key = "Excess Contribution" if "Excess Contribution" in table.columns else "Average Days"
+        ranked = table.nlargest(n, key) if worst else table.nsmallest(n, "Average Days")
+        return ranked.drop(columns=["Weighted"])
+
+    def group_entries(self, dim, key, n=DEFAULT_TOP_N, columns=None):
+        """
+        The worst entries (by Weighted Date Diff, at most top_k) of one client or matter, or None.
+        """
+        positions = self._group_worst.get(dim, {}).get(str(key))
+        return None if positions is None else self._rows(positions[:n], columns)
+
+    def match_group(self, dim, text):
+        """
+        The client / matter named in 'text' (the longest one, so "Client 12" wins over "Client 1"), or None.
+        """
+        matches = [key for key in self._group_worst.get(dim, {}) if key and key.lower() in text]
+        return max(matches, key=len) if matches else None
+
+    def top_contributors(self, n=DEFAULT_TOP_N):
+        positions = self._contribution[:n] if n <= self.top_k else self._top_positions("Excess Contribution", n)
+        return self._rows(positions)
+
+    def weekly_delays(self, n=None, worst=False):
+        return self._period_delays(self.by_week, n, worst)
+
+    def monthly_delays(self, n=None, worst=False):
+        return self._period_delays(self.by_month, n, worst)
+
+    def _period_delays(self, by_period, n, worst):
+        table = by_period.drop(columns=["Weighted"])
+        if worst:
+            return table.nlargest(n or DEFAULT_TOP_N, "Average Days")
+        return table if n is None else table.tail(n)
+
+    def find_timecard(self, index):
+        position = self._timecard_lookup.get(str(index)) if self._timecard_lookup is not None else None
+        if position is None:
+            return None
+        return self._rows([int(position)])
+
+    def summary(self):
+        return (
+            f"Your export has {self.entry_count} entries totalling {self.total_hours:.2f} hours. "
+            f"Weighted Average Days to Enter Time: **{self.average:.2f}** "
+            "(target: below 5)."
+        )
+
+    # ------------------------------------------
+    # Natural-language dispatch
+    # ------------------------------------------
+    def answer(self, user_query):
+        """
+        Maps a question onto one of the queries above using the keywords the app already detects.
+        Returns a markdown string.
+        """
+        query = user_query.lower()
+        dim = "matter" if "matter" in query else "client" if "client" in query else None
+        # A named client / matter ("worst 10 entries for matter 10452-0001"); its digits are not a count
+        group = self.match_group(dim, query) if dim else None
+        numbers = re.findall(r"\b\d+\b", query.replace(group.lower(), " ") if group else query)
+        n = int(numbers[0]) if numbers and not ("timecard" in query or "index" in query) else DEFAULT_TOP_N
+        n = max(1, min(n, TOP_K))
+        worst = not any(word in query for word in ("best", "lowest", "performing well", "good"))
+        label = "worst" if worst else "best"
+
+        if ("timecard" in query or "index" in query) and numbers:
+            match = self.find_timecard(numbers[0])
+            if match is not None:
+                return f"Timecard {numbers[0]}:\n\n" + markdown_table(match)
+
+        if "delay" in query and ("week" in query or "distribution" in query or "trend" in query) and self.by_week is not None:
+            if "worst" in query:
+                return f"The {n} weeks with the highest Average Days to Enter Time:\n\n" + markdown_table(self.weekly_delays(n, worst=True))
+            return "Entry delay by week (most recent weeks):\n\n" + markdown_table(self.weekly_delays(n if numbers else 12))
+
+        if "month" in query and ("delay" in query or "trend" in query or "average" in query) and self.by_month is not None:
+            if "worst" in query:
+                return f"The {n} months with the highest Average Days to Enter Time:\n\n" + markdown_table(self.monthly_delays(n, worst=True))
+            return "Entry delay by month (most recent months):\n\n" + markdown_table(self.monthly_delays(n if numbers else 12))
+
+        if group is not None and worst:
+            return (
+                f"The {n} entries with the highest Weighted Date Diff for {group}:\n\n"
+                + markdown_table(self.group_entries(dim, group, n))
+            )
+
+        if dim and dim in self.by_group and ("compare" in query or "worst" in query or "best" in query or "performing" in query):
+            title = "Client Name" if dim == "client" else "Matter Number"
+            return (
+                f"The {n} {label} {dim}s by impact on your average ({title}):\n\n"
+                + markdown_table(self.ranked_groups(dim, n, worst=worst))
+            )
+
+        if "weighted" in query or "contribut" in query:
+            return (
+                f"{self.summary()}\n\nThe {n} entries contributing most to your weighted average:\n\n"
+                + markdown_table(self.top_contributors(n))
+            )
+
+        if "compare" in query and "client" in self.by_group:
+            return (
+                f"{self.summary()}\n\nClients compared by Average Days to Enter Time:\n\n"
+                + markdown_table(self.ranked_groups("client", n, worst=True))
+            )
+
+        if any(word in query for word in ("worst", "best", "record", "entry", "entries", "timecard", "performing", "delay")):
+            entries = self.worst_entries(n) if worst else self.best_entries(n)
+            return f"The {n} {label} entries by Weighted Date Diff:\n\n" + markdown_table(entries)
+
+        return self.summary()
@@ -0,0 +1,304 @@
+# excel_ingest.py
+#
+# Reading and cleaning of the Cognos "Average Days to Enter Time Detail" Excel export.
+# Parsed + cleaned frames are cached by file hash, so Streamlit reruns (every widget change)
+# do not parse the workbook again.
+# The openpyxl path streams the sheet (read-only mode) in batches of typed rows, so a
+# firm-wide export never exists in memory as one list of Python cell values.
+
+import hashlib
+import importlib.util
+import io
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from tracing import span, traced
+
+# Columns the app uses; everything else in the export is skipped at read time
+TIMECARD_COLUMNS = [
+    "Original Index for Avg Days",
+    "Client Name",
+    "Matter Number",
+    "Timecard Index",
+    "Weighted Date Diff",
+    "Hours Worked",
+    "Work Date",
+    "TimeCard Entry Date",
+    "Days To Enter Time"
+]
+
+# Row (0-based, in a header=None read) holding the real column names in the usual layout.
+# Matches the previous cleaning: default header row + df.iloc[2:] + first remaining row as header.
+HEADER_ROW = 3
+# Leading rows searched for the header (the row naming the most of the needed columns)
+HEADER_SCAN_ROWS = 20
+# Rows parsed and typed at a time by the streaming reader
+DEFAULT_BATCH_ROWS = 10_000
+# Running sums kept while streaming (the inputs of the projection)
+TOTAL_COLUMNS = ["Weighted Date Diff", "Hours Worked"]
+
+# Summed columns stay float64; per-row day counts fit in float32
+NUMERIC_COLUMNS = {"Weighted Date Diff": "float64", "Hours Worked": "float64", "Days To Enter Time": "float32"}
+INDEX_COLUMNS = ["Original Index for Avg Days", "Timecard Index"]
+DATE_COLUMNS = ["Work Date", "TimeCard Entry Date"]
+CATEGORY_COLUMNS = ["Client Name", "Matter Number"]
+
+def excel_engine():
+    """
+    Returns the fastest available reader: calamine (Rust, needs python-calamine) or openpyxl.
+    """
+    if importlib.util.find_spec("python_calamine") is not None:
+        return "calamine"
+    return "openpyxl"
+
+def file_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+def read_preview(data, nrows=5):
+    """
+    Reads only the first rows of the raw sheet (for the "Preview of Uploaded Data" table).
+    """
+    return pd.read_excel(io.BytesIO(data), engine=excel_engine(), nrows=nrows)
+
+def _sheet_rows(data, max_row=None):
+    # Cell values of the first sheet, row by row, without loading the whole sheet
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True, keep_links=False)
+    try:
+        yield from workbook.worksheets[0].iter_rows(max_row=max_row, values_only=True)
+    finally:
+        workbook.close()
+
+def find_header_row(rows, columns=TIMECARD_COLUMNS):
+    """
+    Position of the row (among 'rows', the leading rows of the sheet) that names the most of
+    'columns', or None if no row names any of them.
+    """
+    wanted = set(columns)
+    best, best_count = None, 0
+    for position, row in enumerate(rows):
+        count = sum(1 for value in row if isinstance(value, str) and value.strip() in wanted)
+        if count > best_count:
+            best, best_count = position, count
+    return best
+
+def _leading_rows(data, engine):
+    if engine == "openpyxl":
+        return list(_sheet_rows(data, max_row=HEADER_SCAN_ROWS))
+    head = pd.read_excel(io.BytesIO(data), engine=engine, header=None, nrows=HEADER_SCAN_ROWS)
+    return [tuple(None if pd.isna(value) else value for value in row) for row in head.itertuples(index=False)]
+
+def read_header(data, engine=None, columns=TIMECARD_COLUMNS):
+    """
+    Returns the export's real column names (only the header area of the sheet is read).
+    The header is the leading row naming the most of 'columns' (see find_header_row).
+    """
+    rows = _leading_rows(data, engine or excel_engine())
+    position = find_header_row(rows, columns)
+    if position is None:
+        position = HEADER_ROW
+    if len(rows) <= position:
+        return []
+    return [value.strip() if isinstance(value, str) else value for value in rows[position]]
+
+def _find_columns(header, columns):
+    # Map the needed column names to their positions in the sheet
+    return {
+        name: position for position, name in enumerate(header)
+        if isinstance(name, str) and name in columns
+    }
+
+def _apply_dtypes(df):
+    for col, dtype in NUMERIC_COLUMNS.items():
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype(dtype)
+    for col in INDEX_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    for col in df.columns:
+        # Client / matter plus any extra text columns (e.g. timekeeper, title in bulk mode)
+        if col in CATEGORY_COLUMNS or df[col].dtype == object or isinstance(df[col].dtype, pd.StringDtype):
+            df[col] = df[col].astype("category")
+    return df
+
+def iter_timecard_batches(data, columns=TIMECARD_COLUMNS, batch_size=DEFAULT_BATCH_ROWS):
+    """
+    Streams an uploaded export (raw bytes) as cleaned DataFrames of up to 'batch_size' rows,
+    reading the sheet in openpyxl read-only mode. Only 'columns' are kept, empty rows are
+    skipped and the trailing summary rows are held back and dropped (same rule as read_timecards).
+    Batches carry the dtypes of read_timecards, but each has its own categories.
+    """
+    rows = _sheet_rows(data)
+    leading = []
+    for row in rows:
+        leading.append(row)
+        if len(leading) >= HEADER_SCAN_ROWS:
+            break
+    header_position = find_header_row(leading, columns)
+    if header_position is None:
+        rows.close()
+        return
+    positions = _find_columns(
+        [value.strip() if isinstance(value, str) else value for value in leading[header_position]], columns
+    )
+    ordered = sorted(positions.items(), key=lambda item: item[1])
+    names = [name for name, _ in ordered]
+    picks = [position for _, position in ordered]
+    total_position = names.index("Weighted Date Diff") if "Weighted Date Diff" in names else None
+
+    def data_rows():
+        yield from leading[header_position + 1:]
+        yield from rows
+
+    # Rows are held back from the row before the latest one with a Weighted Date Diff:
+    # the last such row and the one before it are the export's summary rows.
+    pending = []
+    last_valid = None
+    for row in data_rows():
+        values = tuple(row[position] if position < len(row) else None for position in picks)
+        if all(value is None or value == "" for value in values):
+            continue
+        pending.append(values)
+        if total_position is not None and values[total_position] is not None and values[total_position] != "":
+            last_valid = len(pending) - 1
+        safe = len(pending) if total_position is None else (last_valid - 1 if last_valid is not None else 0)
+        if safe >= batch_size:
+            yield _apply_dtypes(pd.DataFrame(pending[:safe], columns=names))
+            del pending[:safe]
+            if last_valid is not None:
+                last_valid -= safe
+    keep = len(pending) if total_position is None or last_valid is None else max(last_valid - 1, 0)
+    if keep:
+        yield _apply_dtypes(pd.DataFrame(pending[:keep], columns=names))
+
+def _union_categories(parts, name):
+    # A batch with no values in a column (e.g. trailing summary rows) has object categories;
+    # give it the category dtype of the others. Mixed kinds (numbers in one batch, text in
+    # another) are combined as plain values and categorized again.
+    kinds = [part.cat.categories.dtype for part in parts if len(part.cat.categories)]
+    if kinds:
+        empty = pd.Index([], dtype=kinds[0])
+        parts = [part if len(part.cat.categories) else part.cat.set_categories(empty) for part in parts]
+    try:
+        return pd.Series(union_categoricals([part.array for part in parts]), name=name)
+    except TypeError:
+        return pd.concat([part.astype(object) for part in parts], ignore_index=True).astype("category")
+
+def _concat_batches(batches, names):
+    if not batches:
+        return pd.DataFrame(columns=names)
+    combined = {}
+    for name in names:
+        parts = [batch[name] for batch in batches]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            combined[name] = _union_categories(parts, name)
+        else:
+            combined[name] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(combined)
+
+def stream_timecards(data, columns=TIMECARD_COLUMNS, batch_size=DEFAULT_BATCH_ROWS, keep_rows=True):
+    """
+    Reads an export batch by batch and returns (df, totals). 'totals' holds the row count and
+    the running sums of the TOTAL_COLUMNS that were found with values (a missing column has
+    no entry, not 0), accumulated as the batches arrive. With keep_rows=False no rows are
+    kept (df is None), so memory stays bounded by one batch whatever the file size.
+    """
+    batches = []
+    totals = {"rows": 0}
+    names = None
+    for batch in iter_timecard_batches(data, columns, batch_size):
+        names = list(batch.columns)
+        totals["rows"] += len(batch)
+        for column in TOTAL_COLUMNS:
+            if column in batch.columns and batch[column].notna().any():
+                totals[column] = totals.get(column, 0.0) + float(batch[column].sum())
+        if keep_rows:
+            batches.append(batch)
+    if not keep_rows:
+        return None, totals
+    df = _concat_batches(batches, names or list(columns))
+    return df.dropna(axis=1, how='all'), totals
+
+@traced()
+def read_timecards(data, engine=None, columns=TIMECARD_COLUMNS):
+    """
+    Parses and cleans an uploaded export (raw bytes). Only 'columns' are read
+    (TIMECARD_COLUMNS by default; bulk mode adds the timekeeper / title columns).
+    Returns a DataFrame with numeric, nullable-integer, datetime and categorical dtypes;
+    df.attrs["totals"] holds the row count and the sums of the TOTAL_COLUMNS that were read.
+    """
+    engine = engine or excel_engine()
+    if engine == "openpyxl":
+        df, totals = stream_timecards(data, columns=columns)
+        df.attrs["totals"] = totals
+        return df
+
+    leading = _leading_rows(data, engine)
+    header_position = find_header_row(leading, columns)
+    if header_position is None:
+        return pd.DataFrame(columns=list(columns))
+    header = [value.strip() if isinstance(value, str) else value for value in leading[header_position]]
+    ordered = sorted(_find_columns(header, columns).items(), key=lambda item: item[1])
+    df = pd.read_excel(
+        io.BytesIO(data), engine=engine, header=None,
+        usecols=[position for _, position in ordered]
+    )
+    df = df.iloc[header_position + 1:].reset_index(drop=True)
+    df.columns = [name for name, _ in ordered]
+    df = df.dropna(axis=1, how='all')
+    df = df.dropna(how='all')
+
+    # Remove the trailing summary rows (same rule as the original cleaning step)
+    if "Weighted Date Diff" in df.columns:
+        valid = df["Weighted Date Diff"].notna()
+        if valid.any():
+            last_valid_index = df.index[valid][-1]
+            df = df.iloc[:last_valid_index - 1]
+
+    df = _apply_dtypes(df.copy())
+    df.attrs["totals"] = {"rows": len(df), **{
+        column: float(df[column].sum()) for column in TOTAL_COLUMNS if column in df.columns
+    }}
+    return df
+
+class _FrameCache:
+    """
+    Small LRU of cleaned frames keyed by file hash, shared by all sessions in the process.
+    Cached frames are shared objects and must be treated as read-only.
+    """
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, load):
+        with self._lock:
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                return self._frames[key]
+        frame = load()
+        with self._lock:
+            self._frames[key] = frame
+            while len(self._frames) > self.maxsize:
+                self._frames.popitem(last=False)
+        return frame
+
+_frame_cache = _FrameCache()
+
+def load_timecards(data, columns=TIMECARD_COLUMNS):
+    """
+    Cached read_timecards: the same file contents (and column selection) are parsed once per process.
+    """
+    with span("load_timecards", bytes=len(data)) as load_span:
+        key = (file_digest(data), tuple(columns))
+        frame = _frame_cache.get_or_load(key, lambda: read_timecards(data, columns=columns))
+        load_span.set(rows=len(frame))
+    return frame
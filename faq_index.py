@@ -0,0 +1,117 @@
+# faq_index.py
+#
+# Semantic FAQ short-circuit: questions that closely match one of the knowledge base's
+# curated Q&A pairs (or a confidentiality rule) are answered with the stored text,
+# without a GPT call. Question embeddings live in their own content-addressed index.
+
+import os
+import threading
+
+from chunked_embeddings import ChunkRetriever, normalize_query
+from embedding_store import DEFAULT_INDEX_DIR, build_store
+from lexical_index import BM25Index, tokenize
+
+FAQ_INDEX_DIR = os.path.join(DEFAULT_INDEX_DIR, "faq")
+# Cosine similarity (ada-002) above which a query counts as the same question.
+# ada-002 similarities are compressed: paraphrases land around 0.93-0.97, related
+# but different questions around 0.85-0.90.
+DEFAULT_FAQ_THRESHOLD = 0.93
+# Share of the query's terms (IDF-weighted) the lexically closest question must contain
+# before the query is embedded; paraphrases that close share most of their content words.
+MIN_TERM_COVERAGE = 0.5
+# Without an embedding (the lexical fast path), a stored question matches when it and the
+# query each contain at least this share of the other's terms
+LEXICAL_MATCH_COVERAGE = 0.9
+
+class FaqIndex:
+    """
+    Nearest stored question for a query: an exact (normalized) text match first,
+    then cosine similarity of the query embedding against every stored question, or,
+    when no embedding may be computed, near-complete term overlap with one.
+    Queries with little term overlap with every stored question are rejected before embedding,
+    so they keep the lexical fast path of find_top_n_chunks.
+    Counts how many queries were answered this way.
+    """
+
+    def __init__(self, entries, embedding_matrix, threshold=DEFAULT_FAQ_THRESHOLD):
+        self.entries = list(entries)
+        self.threshold = threshold
+        questions = [entry["question"] for entry in self.entries]
+        self.retriever = ChunkRetriever(questions, embedding_matrix)
+        self.lexical = BM25Index(questions)
+        self._exact = {}
+        for i, entry in enumerate(self.entries):
+            self._exact.setdefault(normalize_query(entry["question"]), i)
+        self.served = 0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def match(self, query, embed_fn, threshold=None):
+        """
+        Returns (entry, similarity) for the closest stored question when it reaches 'threshold'
+        (the index's threshold by default), else None. 'embed_fn(query)' is only called when
+        there is no exact match, e.g. QueryCache.get_embedding so the embedding is reused for retrieval.
+        With embed_fn=None (retrieval takes the lexical fast path and never embeds the query)
+        only exact and lexical matches (LEXICAL_MATCH_COVERAGE) are made.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        result = None
+        position = self._exact.get(normalize_query(query))
+        if position is not None:
+            result = (self.entries[position], 1.0)
+        elif embed_fn is None:
+            result = self._lexical_match(query)
+        elif self._worth_embedding(query):
+            indices, scores = self.retriever.top_k(embed_fn(query), k=1)
+            if scores[0, 0] >= threshold:
+                result = (self.entries[indices[0, 0]], float(scores[0, 0]))
+        with self._lock:
+            self.total += 1
+            self.served += result is not None
+        return result
+
+    def _lexical_match(self, query):
+        closest = self.lexical.search(query, k=1)
+        if not closest:
+            return None
+        question = closest[0][1]
+        position = self._exact[normalize_query(question)]
+        # Both directions: the query must not add terms the stored question lacks
+        overlap = min(self.lexical.coverage(query, question), self._question_coverage(question, query))
+        return (self.entries[position], overlap) if overlap >= LEXICAL_MATCH_COVERAGE else None
+
+    def _question_coverage(self, question, query):
+        # IDF-weighted share of the stored question's terms that occur in the query
+        terms = set(tokenize(question))
+        query_terms = set(tokenize(query))
+        total = sum(self.lexical.idf[term] for term in terms)
+        return sum(self.lexical.idf[term] for term in terms & query_terms) / total if total else 0.0
+
+    def _worth_embedding(self, query):
+        closest = self.lexical.search(query, k=1)
+        return bool(closest) and self.lexical.coverage(query, closest[0][1]) >= MIN_TERM_COVERAGE
+
+    def stats(self):
+        with self._lock:
+            return {
+                "served": self.served,
+                "total": self.total,
+                "served_rate": self.served / self.total if self.total else 0.0,
+            }
+
+def build_faq_index(entries, threshold=DEFAULT_FAQ_THRESHOLD, index_dir=FAQ_INDEX_DIR, client=None):
+    """
+    Embeds the stored questions (only new or changed ones, see EmbeddingStore) and returns a FaqIndex.
+    'entries' is the list from kb_loader.faq_entries.
+    """
+    store = build_store([entry["question"] for entry in entries], chunk_size=0, index_dir=index_dir, client=client, mmap=True)
+    return FaqIndex(entries, store.matrix, threshold=threshold)
+
+def format_faq_answer(entry, disclaimer=""):
+    """
+    The stored answer, followed by the disclaimer like GPT answers.
+    """
+    return f"{entry['answer']}\n\n{disclaimer}" if disclaimer else entry["answer"]
@@ -0,0 +1,195 @@
+# kb_loader.py
+
+import json
+
+KNOWLEDGE_BASE_PATH = "knowledge_base.json"
+
+def read_knowledge_base(path=KNOWLEDGE_BASE_PATH):
+    """
+    Reads the knowledge base JSON file and returns the parsed dict.
+    Raises FileNotFoundError if the file is missing (callers decide how to report it).
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+def parse_knowledge_base(data):
+    """
+    Parses the knowledge base from the file's bytes (e.g. a kb_watcher snapshot).
+    """
+    return json.loads(data.decode("utf-8"))
+
+def convert_json_to_text(data):
+    """
+    Flattens every 'answer' / 'content' string in the knowledge base into one big text.
+    """
+    text_fragments = []
+    def traverse(obj):
+        if isinstance(obj, dict):
+            for k, v in obj.items():
+                if k.lower() in ["answer", "content"]:
+                    if isinstance(v, str):
+                        text_fragments.append(v)
+                else:
+                    traverse(v)
+        elif isinstance(obj, list):
+            for item in obj:
+                traverse(item)
+    traverse(data)
+    return "\n".join(text_fragments)
+
+# ------------------------------------------
+# Structure-aware chunking
+# ------------------------------------------
+# Sections kept out of retrieval: stored procedure internals are confidential
+# (see 'confidentiality.rules') and section 13 only points at those rules.
+EXCLUDED_SECTIONS = ("2. Stored Procedures", "13. Confidentiality")
+# Script source code and build details add tokens without answering user questions.
+EXCLUDED_KEYS = ("code", "dependencies", "language", "script_name")
+DEFAULT_CHUNK_TOKENS = 300
+
+def _label(key):
+    return key.replace("_", " ").strip().capitalize()
+
+def _is_scalar(value):
+    return isinstance(value, (str, int, float, bool))
+
+def _section_lines(obj, label=""):
+    """
+    Renders a section as a list of self-contained lines: one per Q&A pair,
+    one per record (dict of scalars) and one per free-text string.
+    """
+    prefix = f"{label} - " if label else ""
+    if _is_scalar(obj):
+        return [f"{prefix}{obj}"]
+    if isinstance(obj, list):
+        if obj and all(_is_scalar(item) for item in obj):
+            return [f"{prefix}{item}" for item in obj]
+        lines = []
+        for item in obj:
+            lines.extend(_section_lines(item, label))
+        return lines
+    if not isinstance(obj, dict):
+        return []
+    if "question" in obj and "answer" in obj:
+        return [f"Q: {obj['question']}\nA: {obj['answer']}"]
+
+    fields, lines = [], []
+    for key, value in obj.items():
+        if key in EXCLUDED_KEYS:
+            continue
+        if _is_scalar(value):
+            fields.append(f"{_label(key)}: {value}")
+        elif isinstance(value, list) and all(_is_scalar(item) for item in value):
+            fields.append(f"{_label(key)}: " + "; ".join(str(item) for item in value))
+        else:
+            lines.extend(_section_lines(value, _label(key)))
+    if fields:
+        lines.insert(0, prefix + "; ".join(fields))
+    return lines
+
+def _split_long_line(line, max_tokens, count_tokens):
+    # Word windows for the rare single line that does not fit in one chunk
+    pieces, current = [], []
+    for word in line.split():
+        if current and count_tokens(" ".join(current + [word])) > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+def _slug(text):
+    return "-".join("".join(c if c.isalnum() else " " for c in text.lower()).split())
+
+def chunk_knowledge_base(data, max_tokens=DEFAULT_CHUNK_TOKENS, exclude_sections=EXCLUDED_SECTIONS):
+    """
+    Splits the knowledge base along its own structure: one chunk per section under
+    'knowledge_base.sections', split further (on Q&A / record boundaries) only when a
+    section exceeds 'max_tokens'. No text is repeated between chunks.
+    Returns a list of dicts:
+      [{ "id": "time-entry-cutoff-policy-0", "section": ..., "title": ..., "part": 0, "text": ..., "tokens": ... }, ...]
+    IDs are stable as long as section names and their content split stay the same.
+    """
+    from embedding_client import count_tokens
+
+    sections = data.get("knowledge_base", {}).get("sections", {})
+    chunks = []
+    for section, body in sections.items():
+        if section in exclude_sections:
+            continue
+        title = section.split(". ", 1)[-1]
+        header = f"{title}\n"
+        budget = max(1, max_tokens - count_tokens(header))
+
+        parts, current, current_tokens = [], [], 0
+        for line in _section_lines(body):
+            for piece in _split_long_line(line, budget, count_tokens) if count_tokens(line) > budget else [line]:
+                tokens = count_tokens(piece) + 1
+                if current and current_tokens + tokens > budget:
+                    parts.append(current)
+                    current, current_tokens = [], 0
+                current.append(piece)
+                current_tokens += tokens
+        if current:
+            parts.append(current)
+
+        for part, lines in enumerate(parts):
+            text = header + "\n".join(lines)
+            chunks.append({
+                "id": f"{_slug(title)}-{part}",
+                "section": section,
+                "title": title,
+                "part": part,
+                "text": text,
+                "tokens": count_tokens(text),
+            })
+    return chunks
+
+# ------------------------------------------
+# Curated answers (FAQ short-circuit)
+# ------------------------------------------
+def _qa_pairs(obj):
+    if isinstance(obj, dict):
+        if "question" in obj and "answer" in obj:
+            yield obj["question"], obj["answer"]
+            return
+        for value in obj.values():
+            yield from _qa_pairs(value)
+    elif isinstance(obj, list):
+        for item in obj:
+            yield from _qa_pairs(item)
+
+def faq_entries(data, exclude_sections=EXCLUDED_SECTIONS):
+    """
+    Collects the knowledge base's curated answers that can be served verbatim:
+      - every question / answer pair outside 'exclude_sections' (questions that are repeated from
+        an excluded section, e.g. stored-procedure FAQs copied into '19. FAQ', are dropped too)
+      - the confidentiality rules' canned responses, matched against the rule text
+    Returns a list of dicts: [{ "question": ..., "answer": ..., "section": ..., "kind": "faq" | "confidential" }, ...]
+    """
+    sections = data.get("knowledge_base", {}).get("sections", {})
+    excluded_questions = {
+        question.strip().lower()
+        for section in exclude_sections if section in sections
+        for question, _ in _qa_pairs(sections[section])
+    }
+    entries, seen = [], set()
+    for section, body in sections.items():
+        if section in exclude_sections:
+            continue
+        for question, answer in _qa_pairs(body):
+            key = question.strip().lower()
+            if key in excluded_questions or key in seen:
+                continue
+            seen.add(key)
+            entries.append({"question": question, "answer": answer, "section": section, "kind": "faq"})
+
+    disclaimer = data.get("disclaimers", {}).get("primary_disclaimer")
+    for rule in data.get("confidentiality", {}).get("rules", []):
+        response = rule.get("response") or rule.get("response_without_password")
+        # The disclaimer rule has no question to match; it is appended to every answer instead
+        if not rule.get("rule") or not response or response == disclaimer:
+            continue
+        entries.append({"question": rule["rule"], "answer": response, "section": "confidentiality", "kind": "confidential"})
+    return entries
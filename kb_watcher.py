@@ -0,0 +1,152 @@
+# kb_watcher.py
+#
+# Hot reload of knowledge_base.json without a restart.
+# A daemon thread polls the file's fingerprint (mtime, size). Once a change has settled
+# (same fingerprint on two polls in a row), the new version is built on that thread and
+# then swapped in with a single assignment. Until the swap, every session keeps serving
+# the previous version, so no request waits on a rebuild or sees a half-built index.
+# The build gets the file's bytes, read through one open file together with the
+# fingerprint they belong to, and returns everything the version serves (the app: the
+# parsed knowledge base, calendar, chunks, BM25, FAQ and embedding indexes; the
+# embedding store only embeds new or changed chunks).
+
+import logging
+import os
+import threading
+import time
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the file
+DEFAULT_POLL_INTERVAL = 2.0
+
+def file_fingerprint(path):
+    """
+    (mtime_ns, size) of 'path', or None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def read_snapshot(path):
+    """
+    (fingerprint, data): the bytes of 'path' and the fingerprint of exactly those bytes.
+    (None, None) if the file does not exist or was written to while it was being read.
+    """
+    try:
+        with open(path, "rb") as f:
+            before = os.fstat(f.fileno())
+            data = f.read()
+            after = os.fstat(f.fileno())
+    except FileNotFoundError:
+        return None, None
+    fingerprint = (before.st_mtime_ns, before.st_size)
+    if fingerprint != (after.st_mtime_ns, after.st_size) or len(data) != before.st_size:
+        return None, None
+    return fingerprint, data
+
+class IndexVersion:
+    """
+    One served version of the file: its fingerprint, a number counting up from 1, the
+    value build() returned for it, and when it was built and how long that took.
+    """
+
+    def __init__(self, number, fingerprint, value=None, built_at=None, build_seconds=None):
+        self.number = number
+        self.fingerprint = fingerprint
+        self.value = value
+        self.built_at = built_at if built_at is not None else time.time()
+        self.build_seconds = build_seconds
+
+class KnowledgeBaseWatcher:
+    """
+    Serves the latest successfully built version of 'path' through current(), which is
+    None until the first reload() (call it before start() to build the first version inline).
+    build(data) gets the file's bytes, runs on the watcher thread and returns the version's
+    value with everything it needs ready. A failed build (e.g. a file saved half-way, or
+    invalid JSON) is logged, the previous version stays current and the same
+    fingerprint is not retried; the next change to the file is.
+    """
+
+    def __init__(self, path, build, interval=DEFAULT_POLL_INTERVAL):
+        self.path = path
+        self.build = build
+        self.interval = interval
+        self.last_error = None
+        self._current = None
+        self._failed = None
+        self._build_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        """
+        The version to serve. Read it once per request and use it throughout.
+        """
+        return self._current
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="kb-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        pending = None
+        while not self._stop.wait(self.interval):
+            fingerprint = file_fingerprint(self.path)
+            if fingerprint is None or fingerprint in (self._served_fingerprint(), self._failed):
+                pending = None
+            elif fingerprint != pending:
+                # Changed since the last poll: give the writer one more interval to finish
+                pending = fingerprint
+            else:
+                self.reload(fingerprint)
+                pending = None
+
+    def _served_fingerprint(self):
+        return self._current.fingerprint if self._current is not None else None
+
+    def reload(self, fingerprint=None):
+        """
+        Builds the file as it is now and makes it current. With 'fingerprint' (the one the
+        watcher saw settle), nothing is built if the file has changed since.
+        Returns True if a new version was swapped in.
+        """
+        with self._build_lock:
+            if file_fingerprint(self.path) in (None, self._served_fingerprint()):
+                return False
+            snapshot, data = read_snapshot(self.path)
+            if snapshot is None or snapshot == self._served_fingerprint() or fingerprint not in (None, snapshot):
+                return False
+            number = self._current.number + 1 if self._current is not None else 1
+            start = time.perf_counter()
+            try:
+                with span("kb_reload", version=number):
+                    value = self.build(data)
+            except Exception as e:
+                self._failed = snapshot
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.exception(
+                    "knowledge base reload failed; %s",
+                    f"still serving version {number - 1}" if number > 1 else "no version to serve yet"
+                )
+                return False
+            self._current = IndexVersion(number, snapshot, value, build_seconds=time.perf_counter() - start)
+            self._failed = None
+            self.last_error = None
+            logger.info(
+                "knowledge base version %d built in %.2fs and swapped in",
+                self._current.number, self._current.build_seconds
+            )
+            return True
@@ -0,0 +1,135 @@
+# lexical_index.py
+#
+# In-process BM25 index over the knowledge-base chunks, plus reciprocal-rank fusion
+# for combining it with the embedding ranking from find_top_n_chunks.
+# Exact keywords ("cutoff", "Intapp", "timecard", month names) are matched here without
+# any API call; a confident lexical hit can answer without embedding the query at all.
+
+import math
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# Words that carry no retrieval signal in this knowledge base's questions
+STOPWORDS = frozenset("""
+a an and are as at be been being but by can could did do does doing for from had has have
+how i if in into is it its me my of on or our should so than that the their them then there
+these they this to was we were what when where which who why will with would you your
+""".split())
+
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+# Standard RRF constant: damps the weight of the very first ranks
+DEFAULT_RRF_K = 60
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def _stem(token):
+    # Just enough folding for plurals ("timecards" -> "timecard", "entries" -> "entry")
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def tokenize(text):
+    """
+    Lower-cased alphanumeric terms with stopwords removed and plurals folded.
+    """
+    return [_stem(token) for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed list of chunk texts. Postings are numpy arrays per term,
+    so a query costs one vectorized update per query term.
+    """
+
+    def __init__(self, chunks, k1=DEFAULT_K1, b=DEFAULT_B):
+        self.chunks = list(chunks)
+        self.k1 = k1
+        self.b = b
+
+        doc_terms = [Counter(tokenize(chunk)) for chunk in self.chunks]
+        self._terms_by_chunk = {chunk: set(terms) for chunk, terms in zip(self.chunks, doc_terms)}
+        lengths = np.array([sum(terms.values()) for terms in doc_terms], dtype=np.float64)
+        average_length = lengths.mean() if len(lengths) and lengths.mean() > 0 else 1.0
+        # Per-document length normalization, computed once
+        self._norm = k1 * (1 - b + b * lengths / average_length)
+
+        postings = defaultdict(lambda: ([], []))
+        for doc, terms in enumerate(doc_terms):
+            for term, count in terms.items():
+                postings[term][0].append(doc)
+                postings[term][1].append(count)
+        n = len(self.chunks)
+        self.postings = {}
+        self.idf = {}
+        for term, (docs, counts) in postings.items():
+            self.postings[term] = (np.array(docs, dtype=np.intp), np.array(counts, dtype=np.float64))
+            self.idf[term] = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def scores(self, query):
+        """
+        Returns the BM25 score of every chunk for 'query' (an array, one entry per chunk).
+        """
+        scores = np.zeros(len(self.chunks))
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            docs, counts = self.postings[term]
+            scores[docs] += self.idf[term] * counts * (self.k1 + 1) / (counts + self._norm[docs])
+        return scores
+
+    def search(self, query, k=2):
+        """
+        Returns a list of (bm25_score, chunk_text) for the top 'k' chunks with a non-zero score,
+        sorted descending by score.
+        """
+        scores = self.scores(query)
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(float(scores[i]), self.chunks[i]) for i in top if scores[i] > 0][:k]
+
+    def coverage(self, query, chunk):
+        """
+        IDF-weighted share of the query's terms that occur in 'chunk' (one of the indexed texts), in [0, 1].
+        Query words the index has never seen count as missing.
+        """
+        query_terms = set(tokenize(query))
+        known = [term for term in query_terms if term in self.idf]
+        if not known:
+            return 0.0
+        chunk_terms = self._terms_by_chunk[chunk]
+        covered = sum(self.idf[term] for term in known if term in chunk_terms) / sum(self.idf[term] for term in known)
+        return covered * len(known) / len(query_terms)
+
+    def confidence(self, query, results=None):
+        """
+        How safely the lexical ranking can stand on its own, in [0, 1]: the coverage of
+        the top chunk times its relative margin over the runner-up.
+        """
+        results = self.search(query, k=2) if results is None else results
+        if not results:
+            return 0.0
+        runner_up = results[1][0] if len(results) > 1 else 0.0
+        margin = 1.0 - runner_up / results[0][0]
+        return self.coverage(query, results[0][1]) * margin
+
+def reciprocal_rank_fusion(rankings, n=2, k=DEFAULT_RRF_K):
+    """
+    Fuses several rankings (lists of (score, chunk_text), best first) by summing 1 / (k + rank).
+    Only ranks matter, so BM25 and cosine scores need no calibration against each other.
+    Returns a list of (fused_score, chunk_text) sorted descending by fused score.
+    """
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, (_, chunk) in enumerate(ranking, start=1):
+            fused[chunk] += 1.0 / (k + rank)
+    return sorted(((score, chunk) for chunk, score in fused.items()), key=lambda item: item[0], reverse=True)[:n]
@@ -0,0 +1,199 @@
+# llm_backend.py
+#
+# Pluggable backend for the Embedding / ChatCompletion calls made by chunked_embeddings,
+# embedding_client and the app. OpenAIBackend forwards to the openai package; FakeBackend
+# is a deterministic local stand-in (hashed bag-of-words embeddings, canned completions,
+# configurable latency) for benchmarks and offline runs.
+# Select with set_backend(...) or LLM_BACKEND=fake in the environment.
+
+import hashlib
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+EMBEDDING_DIM = 1536
+# Keep-alive connections to the OpenAI API shared by all threads (sessions) of the process
+HTTP_POOL_SIZE = int(os.environ.get("OPENAI_HTTP_POOL_SIZE", "16"))
+
+class PooledSessions:
+    """
+    Value for openai.requestssession that shares one connection pool between threads.
+    openai 0.28 keeps a session per thread and closes it every MAX_SESSION_LIFETIME_SECS;
+    each call here returns a new, lightweight requests.Session mounting the same HTTPS
+    adapter, whose pool survives those closes (close() ends it for good).
+    Like openai's own sessions, each one routes through openai.proxy as set at that moment;
+    the adapter keeps a pool per proxy. requests adapters are safe to share between threads.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE):
+        from requests.adapters import HTTPAdapter
+
+        class SharedAdapter(HTTPAdapter):
+            def close(self):
+                # Called by every Session.close(); the pool belongs to PooledSessions
+                pass
+
+        self.adapter = SharedAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=2)
+
+    def __call__(self):
+        import openai
+        import requests
+        from openai.api_requestor import _requests_proxies_arg
+
+        session = requests.Session()
+        # Same conversion (and ValueError for an invalid value) as openai's default session
+        proxies = _requests_proxies_arg(openai.proxy)
+        if proxies:
+            session.proxies = proxies
+        session.mount("https://", self.adapter)
+        return session
+
+    def close(self):
+        self.adapter.poolmanager.clear()
+        for proxy in self.adapter.proxy_manager.values():
+            proxy.clear()
+
+class OpenAIBackend:
+    """
+    Thin pass-through to openai.Embedding.create / openai.ChatCompletion.create.
+    The openai functions are looked up on every call, so patching them still works.
+    With 'http_sessions' (see PooledSessions), the per-thread sessions openai creates all
+    use one connection pool, so TLS connections are reused across Streamlit sessions.
+    """
+
+    name = "openai"
+    requires_api_key = True
+
+    def __init__(self, http_sessions=None):
+        self.http_sessions = http_sessions
+
+    def model_id(self, model):
+        # Identifies the vectors an embedding index holds (see EmbeddingStore)
+        return model
+
+    def _openai(self):
+        import openai
+        if self.http_sessions is not None and openai.requestssession is not self.http_sessions:
+            openai.requestssession = self.http_sessions
+        return openai
+
+    def embedding_create(self, **kwargs):
+        return self._openai().Embedding.create(**kwargs)
+
+    def chat_completion_create(self, **kwargs):
+        return self._openai().ChatCompletion.create(**kwargs)
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+class FakeBackend:
+    """
+    Deterministic, offline stand-in returning responses in the openai 0.28 shapes.
+
+    Embeddings are feature-hashed bags of words (each word adds +-1 to one of 'dim'
+    coordinates), so texts sharing words are similar and retrieval stays meaningful.
+    Completions echo the first excerpt line of the prompt; streaming yields one word
+    per chunk. 'embedding_latency' is slept per request, 'chat_latency' before the
+    first token and 'token_latency' per streamed token.
+    """
+
+    name = "fake"
+    requires_api_key = False
+
+    def __init__(self, dim=EMBEDDING_DIM, embedding_latency=0.0, chat_latency=0.0, token_latency=0.0,
+                 completion="Based on the knowledge base: {excerpt}"):
+        self.dim = dim
+        self.embedding_latency = embedding_latency
+        self.chat_latency = chat_latency
+        self.token_latency = token_latency
+        self.completion = completion
+        self.embedding_requests = 0
+        self.chat_requests = 0
+        self._lock = threading.Lock()
+
+    def model_id(self, model):
+        # Fake vectors must never be mistaken for (or overwrite) a real index
+        return f"fake-{self.dim}:{model}"
+
+    def embed_text(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in _WORD_RE.findall(text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dim] += 1.0 if (value >> 63) else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embedding_create(self, input, model, **kwargs):
+        texts = [input] if isinstance(input, str) else list(input)
+        with self._lock:
+            self.embedding_requests += 1
+        if self.embedding_latency:
+            time.sleep(self.embedding_latency)
+        tokens = sum(len(text) // 4 + 1 for text in texts)
+        return {
+            "data": [{"index": i, "embedding": self.embed_text(text).tolist()} for i, text in enumerate(texts)],
+            "model": model,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _answer(self, messages):
+        prompt = messages[-1]["content"] if messages else ""
+        excerpts = prompt.split("Excerpts:\n", 1)[-1]
+        lines = [line for line in excerpts.splitlines() if line.strip()]
+        # The first line of an excerpt is its section title; the second its first fact
+        excerpt = lines[1] if len(lines) > 1 else (lines[0] if lines else "")
+        return self.completion.format(excerpt=excerpt)
+
+    def chat_completion_create(self, messages, model, stream=False, **kwargs):
+        with self._lock:
+            self.chat_requests += 1
+        if self.chat_latency:
+            time.sleep(self.chat_latency)
+        answer = self._answer(messages)
+        if not stream:
+            return {
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "model": model,
+                "usage": {
+                    "prompt_tokens": sum(len(m["content"]) // 4 + 1 for m in messages),
+                    "completion_tokens": len(answer) // 4 + 1,
+                },
+            }
+        return self._stream(answer)
+
+    def _stream(self, answer):
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield {"choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}}]}
+
+BACKENDS = {"openai": OpenAIBackend, "fake": FakeBackend}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """
+    Returns the process-wide backend, created from LLM_BACKEND (default "openai") on first use.
+    The OpenAI backend gets a shared HTTP connection pool (PooledSessions, HTTP_POOL_SIZE connections).
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = os.environ.get("LLM_BACKEND", "openai")
+                _backend = OpenAIBackend(PooledSessions()) if name == "openai" else BACKENDS[name]()
+    return _backend
+
+def set_backend(backend):
+    """
+    Replaces the process-wide backend (e.g. FakeBackend(...) in benchmarks). Returns the previous one.
+    """
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
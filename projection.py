@@ -0,0 +1,234 @@
+# projection.py
+#
+# Projection of Average Days to Enter Time: how many more sessions at a given entry delay
+# and hours per session bring the average below 5, when that happens, and the title's reset date.
+# Scalar helpers serve the single-user view; the *_array / project_team functions work on
+# whole columns at once for team-wide (bulk) projections.
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from business_calendar import DEFAULT_CALENDAR
+from tracing import traced
+
+TARGET_AVERAGE = 4.99
+
+@traced()
+def calculate_required_days(current_weighted_date_diff, current_hours_worked, user_promised_hours, user_delay):
+    """
+    Number of additional sessions (one per working day) of 'user_promised_hours' entered
+    'user_delay' days late that bring the average below 5.
+    'Required Days' is None when that can never happen (delay >= 4.99 or no hours per session).
+    """
+    current_average, required_days, projected_average = required_days_array(
+        current_weighted_date_diff, current_hours_worked, user_promised_hours, user_delay
+    )
+    reachable = not np.isnan(required_days)
+    return {
+        'Current Average': float(current_average),
+        'Projected Average': float(projected_average) if reachable else None,
+        'Required Days': int(required_days) if reachable else None
+    }
+
+def get_upcoming_reset_date(title, current_date):
+    """
+    If title is 'Associate' or 'Staff Attorney' (case-insensitive),
+    reset is November 1. Otherwise, October 1.
+    """
+    title_lower = title.lower()
+    if "associate" in title_lower or "staff attorney" in title_lower:
+        reset_month, reset_day = 11, 1
+    else:
+        reset_month, reset_day = 10, 1
+
+    year = current_date.year
+    candidate = datetime(year, reset_month, reset_day).date()
+    if current_date <= candidate:
+        return candidate
+    else:
+        return datetime(year + 1, reset_month, reset_day).date()
+
+# Helper to skip weekends (and firm holidays) if needed
+def add_business_days(start_date, days_needed, calendar=DEFAULT_CALENDAR):
+    return calendar.add_business_days(start_date, days_needed)
+
+# ------------------------------------------
+# What-if grid and inverse solver
+# ------------------------------------------
+DEFAULT_GRID_DELAYS = np.round(np.arange(0.0, 5.0, 0.5), 1)
+DEFAULT_GRID_HOURS = np.arange(2.0, 12.5, 1.5)
+
+def projection_grid(current_weighted_date_diff, current_hours_worked, start_date,
+                    delays=DEFAULT_GRID_DELAYS, hours=DEFAULT_GRID_HOURS,
+                    weekdays_only=True, calendar=DEFAULT_CALENDAR):
+    """
+    Required days and target dates for every (entry delay, hours per session) pair in one
+    vectorized pass. Returns (required_days, target_dates) DataFrames indexed by delay with
+    one column per hours value; unreachable cells are <NA> / NaT.
+    """
+    delays = np.asarray(delays, dtype=np.float64)
+    hours = np.asarray(hours, dtype=np.float64)
+    _, days, _ = required_days_array(
+        current_weighted_date_diff, current_hours_worked, hours[np.newaxis, :], delays[:, np.newaxis]
+    )
+    start = np.datetime64(start_date, "D")
+    if weekdays_only:
+        targets = calendar.add_business_days(np.full(days.shape, start), days)
+    else:
+        targets = np.where(np.isnan(days), np.datetime64("NaT"), start + np.nan_to_num(days).astype("timedelta64[D]"))
+
+    index = pd.Index(delays, name="Entry Delay (days)")
+    columns = pd.Index(hours, name="Hours per Session")
+    required = pd.DataFrame(days, index=index, columns=columns).astype("Int64")
+    target_dates = pd.DataFrame(targets, index=index, columns=columns)
+    return required, target_dates
+
+def max_delay_for_deadline(current_weighted_date_diff, current_hours_worked, user_promised_hours,
+                           start_date, deadline, weekdays_only=True, calendar=DEFAULT_CALENDAR):
+    """
+    Inverse problem: the largest entry delay that still brings the average below 5 by 'deadline'
+    (e.g. the get_upcoming_reset_date result), entering 'user_promised_hours' every working day.
+    Vectorized over user_promised_hours. Returns NaN where even same-day entry is not enough.
+    With no session left before the deadline (e.g. start == deadline) the delay no longer matters:
+    returns 0 where the target is already met, else the current slack (TARGET_AVERAGE minus the
+    current average, negative) instead of NaN.
+    """
+    if weekdays_only:
+        sessions = calendar.business_days_between(start_date, deadline)
+    else:
+        sessions = (np.datetime64(deadline, "D") - np.datetime64(start_date, "D")).astype(np.int64)
+    promised = np.asarray(user_promised_hours, dtype=np.float64)
+    if int(sessions) <= 0:
+        current_average = current_weighted_date_diff / current_hours_worked if current_hours_worked else 0.0
+        return np.full(promised.shape, min(TARGET_AVERAGE - current_average, 0.0))
+    added_hours = promised * int(sessions)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # (W + p*d*D) / (H + p*D) <= 4.99  <=>  d <= (4.99 * (H + p*D) - W) / (p*D)
+        delay = (TARGET_AVERAGE * (current_hours_worked + added_hours) - current_weighted_date_diff) / added_hours
+    return np.where(np.isfinite(delay) & (delay >= 0), np.minimum(delay, TARGET_AVERAGE), np.nan)
+
+# ------------------------------------------
+# Vectorized projection (bulk / team mode)
+# ------------------------------------------
+def required_days_array(current_weighted_date_diff, current_hours_worked, user_promised_hours, user_delay):
+    """
+    Array version of calculate_required_days: returns (current_average, required_days, projected_average).
+    Inputs broadcast against each other. required_days is NaN where the target can never be
+    reached (entry delay >= 4.99 or no hours per session, with an average still above it).
+    """
+    weighted = np.asarray(current_weighted_date_diff, dtype=np.float64)
+    hours = np.asarray(current_hours_worked, dtype=np.float64)
+    weighted, hours, promised, delay = np.broadcast_arrays(
+        weighted, hours,
+        np.asarray(user_promised_hours, dtype=np.float64),
+        np.asarray(user_delay, dtype=np.float64)
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        current_average = np.where(hours != 0, weighted / hours, 0.0)
+        needed = TARGET_AVERAGE * hours - weighted
+        per_day = promised * delay - TARGET_AVERAGE * promised
+        raw_days = np.where(per_day < 0, needed / per_day, np.nan)
+        required_days = np.where(needed >= 0, 0.0, np.round(np.maximum(raw_days, 0)))
+        projected_hours = hours + promised * required_days
+        projected_weighted = weighted + promised * delay * required_days
+        projected_average = np.where(projected_hours != 0, projected_weighted / projected_hours, 0.0)
+    return current_average, required_days, projected_average
+
+def upcoming_reset_date_array(titles, current_dates):
+    """
+    Vectorized get_upcoming_reset_date for a Series of titles and an array of dates.
+    """
+    titles = pd.Series(titles, dtype="string").fillna("").str.lower()
+    november = (titles.str.contains("associate") | titles.str.contains("staff attorney")).to_numpy(dtype=bool)
+    dates = pd.DatetimeIndex(np.asarray(current_dates, dtype="datetime64[D]"))
+    month = np.where(november, 11, 10)
+    candidate = pd.to_datetime({"year": dates.year, "month": month, "day": 1})
+    next_year = pd.to_datetime({"year": dates.year + 1, "month": month, "day": 1})
+    return np.where(dates.to_numpy() <= candidate.to_numpy(), candidate.to_numpy(), next_year.to_numpy()).astype("datetime64[D]")
+
+@traced()
+def project_team(df, timekeeper_column, user_promised_hours, user_delay, title_column=None,
+                 default_title="Associate", as_of=None, weekdays_only=True, calendar=DEFAULT_CALENDAR):
+    """
+    Runs the projection for every timekeeper in 'df' (cleaned timecard rows) in one pass.
+    Each timekeeper's projection starts from 'as_of' or, by default, their last Work Date;
+    with weekdays_only, target dates skip weekends and the holidays in 'calendar'.
+    Returns one row per timekeeper.
+    """
+    agg = {
+        "Weighted Date Diff": ("Weighted Date Diff", "sum"),
+        "Hours Worked": ("Hours Worked", "sum"),
+        "Entries": ("Weighted Date Diff", "size"),
+    }
+    if "Work Date" in df.columns:
+        agg["Last Work Date"] = ("Work Date", "max")
+    if title_column:
+        agg["Title"] = (title_column, "first")
+    grouped = df.groupby(timekeeper_column, observed=True, sort=True).agg(**agg).reset_index()
+
+    current_average, required_days, projected_average = required_days_array(
+        grouped["Weighted Date Diff"].to_numpy(), grouped["Hours Worked"].to_numpy(),
+        user_promised_hours, user_delay
+    )
+    if as_of is not None or "Last Work Date" not in grouped:
+        start = np.full(len(grouped), np.datetime64(as_of or datetime.today().date(), "D"))
+    else:
+        start = grouped["Last Work Date"].to_numpy(dtype="datetime64[D]")
+    if weekdays_only:
+        target = calendar.add_business_days(start, required_days)
+    else:
+        target = np.where(
+            np.isnan(required_days), np.datetime64("NaT"), start + np.nan_to_num(required_days).astype("timedelta64[D]")
+        )
+    titles = grouped["Title"] if title_column else pd.Series([default_title] * len(grouped))
+    reset = upcoming_reset_date_array(titles, start)
+
+    grouped["Current Average"] = current_average
+    grouped["Required Days"] = pd.array(np.where(np.isnan(required_days), None, required_days), dtype="Int64")
+    grouped["Projected Average"] = np.where(np.isnan(required_days), np.nan, projected_average)
+    grouped["Target Date"] = pd.to_datetime(target)
+    grouped["Reset Date"] = pd.to_datetime(reset)
+    grouped["Reaches Target Before Reset"] = grouped["Target Date"].le(grouped["Reset Date"])
+    return grouped
+
+if __name__ == "__main__":
+    # CLI: python projection.py <export.xlsx | folder> ... --timekeeper-column "Timekeeper" [--out team.csv]
+    from excel_ingest import TIMECARD_COLUMNS, read_timecards
+
+    parser = argparse.ArgumentParser(description="Team-wide Average Days to Enter Time projection")
+    parser.add_argument("paths", nargs="+", help="Excel exports or folders containing them")
+    parser.add_argument("--timekeeper-column", required=True)
+    parser.add_argument("--title-column")
+    parser.add_argument("--default-title", default="Associate")
+    parser.add_argument("--hours", type=float, default=7.5, help="Hours entered per session")
+    parser.add_argument("--delay", type=float, default=1.0, help="Entry delay in days")
+    parser.add_argument("--include-weekends", action="store_true")
+    parser.add_argument("--out", default="team_projection.csv")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".xlsx")))
+        else:
+            files.append(path)
+    if not files:
+        sys.exit("No .xlsx files found.")
+    columns = TIMECARD_COLUMNS + [c for c in (args.timekeeper_column, args.title_column) if c]
+    frames = []
+    for path in files:
+        with open(path, "rb") as f:
+            frames.append(read_timecards(f.read(), columns=columns))
+    team = project_team(
+        pd.concat(frames, ignore_index=True), args.timekeeper_column, args.hours, args.delay,
+        title_column=args.title_column, default_title=args.default_title,
+        weekdays_only=not args.include_weekends
+    )
+    team.to_csv(args.out, index=False)
+    print(f"Projected {len(team)} timekeepers from {len(files)} file(s) into {args.out}")
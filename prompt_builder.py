@@ -0,0 +1,139 @@
+# prompt_builder.py
+#
+# Token-budgeted assembly of the knowledge-base excerpts sent to GPT.
+# The highest-scoring chunks are packed whole while they fit, then line / sentence at a time;
+# text repeated between chunks (split_text's word overlap, FAQ entries that appear in
+# several sections) is sent only once.
+
+import re
+
+from embedding_client import count_tokens
+from tracing import traced
+
+GPT_MODEL = "gpt-4"
+# Token budget for the excerpts block of the prompt; tuned with `python benchmarks.py prompt`
+DEFAULT_CONTEXT_TOKENS = 400
+EXCERPT_SEPARATOR = "\n\n"
+# Shortest run of words treated as chunk overlap rather than a coincidence
+MIN_OVERLAP_WORDS = 8
+# Shorter pieces ("Yes.", section titles) may repeat legitimately and are never deduplicated
+MIN_DUPLICATE_WORDS = 4
+# Chat format overhead (per message and for priming the reply), as documented for gpt-3.5/gpt-4
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+
+def count_message_tokens(messages, model=GPT_MODEL):
+    """
+    Returns the prompt tokens a chat request with 'messages' uses.
+    """
+    return sum(
+        TOKENS_PER_MESSAGE + sum(count_tokens(value, model=model) for value in message.values())
+        for message in messages
+    ) + TOKENS_PER_REPLY
+
+def split_units(text):
+    """
+    Splits a chunk into self-contained pieces: one per line for structured chunks (a "Q:" line
+    stays with its "A:" line), sentences for plain word-window chunks from split_text.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) > 1:
+        units = []
+        for line in lines:
+            if line.startswith("A:") and units and units[-1].startswith("Q:"):
+                units[-1] += "\n" + line
+            else:
+                units.append(line)
+        return units
+    return [sentence.strip() for sentence in _SENTENCE_RE.split(text) if sentence.strip()]
+
+def _overlap(left, right, min_words=MIN_OVERLAP_WORDS):
+    # Length of the longest suffix of 'left' that is also a prefix of 'right'
+    for size in range(min(len(left), len(right)), min_words - 1, -1):
+        if left[-size:] == right[:size]:
+            return size
+    return 0
+
+def strip_overlap(text, included, min_words=MIN_OVERLAP_WORDS):
+    """
+    Removes from 'text' the words it shares with the start or end of an already included
+    excerpt (the overlap split_text carries between consecutive chunks).
+    Returns (remaining_text, removed_word_count).
+    """
+    words = text.split()
+    removed = 0
+    for other in included:
+        other_words = other.split()
+        head = _overlap(other_words, words, min_words)
+        if head:
+            words = words[head:]
+            removed += head
+        tail = _overlap(words, other_words, min_words)
+        if tail:
+            words = words[:-tail]
+            removed += tail
+    if not removed:
+        return text, 0
+    return " ".join(words), removed
+
+@traced()
+def build_context(scored_chunks, max_tokens=DEFAULT_CONTEXT_TOKENS, model=GPT_MODEL):
+    """
+    Packs (score, chunk_text) pairs into one excerpts string of at most 'max_tokens' tokens.
+    Chunks go in by descending score; a chunk that does not fit whole contributes the pieces
+    (lines / sentences, see split_units) that still fit. Pieces already included are skipped.
+    Returns (context, stats) with stats = { "tokens", "chunks", "units_dropped",
+    "duplicate_units", "overlap_words" }.
+    """
+    separator_tokens = count_tokens(EXCERPT_SEPARATOR, model=model)
+    excerpts, seen = [], set()
+    used = 0
+    stats = {"tokens": 0, "chunks": 0, "units_dropped": 0, "duplicate_units": 0, "overlap_words": 0}
+
+    for _, chunk in sorted(scored_chunks, key=lambda item: item[0], reverse=True):
+        text, removed = strip_overlap(chunk, excerpts)
+        stats["overlap_words"] += removed
+
+        units = []
+        for unit in split_units(text):
+            key = " ".join(unit.lower().split())
+            if len(key.split()) >= MIN_DUPLICATE_WORDS:
+                if key in seen:
+                    stats["duplicate_units"] += 1
+                    continue
+                seen.add(key)
+            units.append(unit)
+        if not units:
+            continue
+
+        budget = max_tokens - used - (separator_tokens if excerpts else 0)
+        whole = "\n".join(units)
+        whole_tokens = count_tokens(whole, model=model)
+        if whole_tokens <= budget:
+            kept, kept_tokens = whole, whole_tokens
+        else:
+            kept_units, kept_tokens = [], 0
+            for unit in units:
+                tokens = count_tokens(unit, model=model) + 1
+                if kept_tokens + tokens <= budget:
+                    kept_units.append(unit)
+                    kept_tokens += tokens
+                else:
+                    stats["units_dropped"] += 1
+            # A structured chunk's title line alone carries nothing
+            if kept_units == units[:1] and len(units) > 1:
+                stats["units_dropped"] += 1
+                kept_units, kept_tokens = [], 0
+            kept = "\n".join(kept_units)
+        if not kept:
+            continue
+
+        used += kept_tokens + (separator_tokens if excerpts else 0)
+        excerpts.append(kept)
+        stats["chunks"] += 1
+
+    context = EXCERPT_SEPARATOR.join(excerpts)
+    stats["tokens"] = count_tokens(context, model=model) if context else 0
+    return context, stats
@@ -0,0 +1,40 @@
+# test_kb_loader.py
+#
+# Pins the structure-aware chunking of knowledge_base.json (see bench_chunking):
+# a change to the chunker or the file that moves these numbers should be deliberate.
+
+from chunked_embeddings import split_text
+from embedding_client import count_tokens
+from kb_loader import DEFAULT_CHUNK_TOKENS, EXCLUDED_SECTIONS, chunk_knowledge_base, read_knowledge_base
+
+def _mean_prompt_tokens(chunks, top_n=2):
+    # Tokens the top-n chunks add to a GPT prompt, for a chunk of average size
+    return round(sum(count_tokens(chunk) for chunk in chunks) / len(chunks) * top_n)
+
+def test_chunk_count():
+    # One chunk per section (17 after the exclusions), plus the parts of sections over the budget
+    chunks = chunk_knowledge_base(read_knowledge_base())
+    assert len(chunks) == 35
+    assert len({chunk["section"] for chunk in chunks}) == 17
+
+def test_excluded_sections_never_chunked():
+    chunks = chunk_knowledge_base(read_knowledge_base())
+    assert set(EXCLUDED_SECTIONS) == {"2. Stored Procedures", "13. Confidentiality"}
+    assert not {chunk["section"] for chunk in chunks} & set(EXCLUDED_SECTIONS)
+    for section in EXCLUDED_SECTIONS:
+        title = section.split(". ", 1)[-1]
+        assert not any(chunk["text"].startswith(f"{title}\n") for chunk in chunks)
+
+def test_no_chunk_over_budget():
+    chunks = chunk_knowledge_base(read_knowledge_base())
+    assert DEFAULT_CHUNK_TOKENS == 300
+    assert max(count_tokens(chunk["text"]) for chunk in chunks) <= DEFAULT_CHUNK_TOKENS
+    assert all(chunk["tokens"] == count_tokens(chunk["text"]) for chunk in chunks)
+
+def test_prompt_tokens_reduced():
+    # The same sections through the previous 300-word / 50-overlap windows: 19 chunks, ~900 prompt tokens
+    structured = [chunk["text"] for chunk in chunk_knowledge_base(read_knowledge_base())]
+    windows = split_text("\n".join(structured), chunk_size=300, overlap=50)
+    assert len(windows) == 19
+    assert _mean_prompt_tokens(windows) == 899
+    assert _mean_prompt_tokens(structured) == 408
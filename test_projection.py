@@ -0,0 +1,20 @@
+# test_projection.py
+
+import numpy as np
+
+from projection import TARGET_AVERAGE, max_delay_for_deadline
+
+def test_max_delay_for_deadline_solves_the_average():
+    # 9 working days (Mar 4-14) of 8 hours at the returned delay land exactly on the target
+    delay = float(max_delay_for_deadline(60, 10, 8, "2025-03-03", "2025-03-14"))
+    assert np.isclose((60 + 8 * 9 * delay) / (10 + 8 * 9), TARGET_AVERAGE)
+
+def test_max_delay_for_deadline_without_sessions():
+    # start == deadline: no session left, so no NaN; the slack when above target, 0 when it is met
+    above = max_delay_for_deadline(60, 10, [8, 4], "2025-03-03", "2025-03-03")
+    assert np.allclose(above, TARGET_AVERAGE - 6.0)
+    met = max_delay_for_deadline(40, 10, [8, 4], "2025-03-03", "2025-03-03")
+    assert np.array_equal(met, [0.0, 0.0])
+    # Only a weekend before the deadline counts as no session too
+    assert float(max_delay_for_deadline(40, 10, 8, "2025-03-07", "2025-03-09")) == 0.0
+    assert not np.isnan(max_delay_for_deadline(60, 10, 8, "2025-03-03", "2025-03-03", weekdays_only=False))
@@ -0,0 +1,203 @@
+# tracing.py
+#
+# Lightweight span timing for the RAG and Excel pipelines.
+# Each finished span is written as one JSON log line (logger "trace") with
+# OpenTelemetry-style fields (trace_id / span_id / parent_id, start / end time,
+# attributes), and its duration is kept in a small per-stage window so the app's
+# admin panel can show p50 / p95 for the current process.
+#
+# Usage:
+#     with span("ask_gpt", model="gpt-4"):
+#         ...
+#         record(api_calls=1, prompt_tokens=812)   # added to this span and its parents
+#
+#     @traced("split_text")
+#     def split_text(...): ...
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger("trace")
+
+# TRACE_LOG=0 keeps the statistics but stops the JSON log lines
+TRACE_LOG_ENABLED = os.environ.get("TRACE_LOG", "1") != "0"
+# Durations kept per stage for the percentiles
+STATS_WINDOW = 1000
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    """
+    One timed stage. 'attributes' holds descriptive values set at start / via set();
+    counters (api_calls, retries, embedding_tokens, prompt_tokens, completion_tokens)
+    are accumulated with record().
+    """
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.attributes = dict(attributes or {})
+        self.counters = defaultdict(int)
+        self.status = "OK"
+        self.start_wall = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self._lock = threading.Lock()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.counters[key] += value
+
+    def to_dict(self):
+        end_wall = self.start_wall + (self.duration or 0.0)
+        return {
+            "name": self.name,
+            "context": {"trace_id": self.trace_id, "span_id": self.span_id},
+            "parent_id": self.parent.span_id if self.parent else None,
+            "start_time": datetime.fromtimestamp(self.start_wall, timezone.utc).isoformat(),
+            "end_time": datetime.fromtimestamp(end_wall, timezone.utc).isoformat(),
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "status": self.status,
+            "attributes": {**self.attributes, **self.counters},
+        }
+
+class StageStats:
+    """
+    Thread-safe, bounded record of finished spans per stage name (shared by the whole process).
+    """
+
+    def __init__(self, window=STATS_WINDOW):
+        self.window = window
+        self._durations = defaultdict(lambda: deque(maxlen=self.window))
+        self._totals = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self._durations[span.name].append(span.duration)
+            totals = self._totals[span.name]
+            totals["count"] += 1
+            totals["errors"] += span.status != "OK"
+            for key, value in span.counters.items():
+                totals[key] += value
+
+    def summary(self):
+        """
+        Returns one dict per stage: count, errors, p50_ms, p95_ms, max_ms (over the last
+        'window' spans) and the counter totals, sorted by stage name.
+        """
+        with self._lock:
+            rows = []
+            for name, durations in sorted(self._durations.items()):
+                ordered = sorted(durations)
+                rows.append({
+                    "stage": name,
+                    "p50_ms": _percentile(ordered, 50) * 1000,
+                    "p95_ms": _percentile(ordered, 95) * 1000,
+                    "max_ms": ordered[-1] * 1000,
+                    **self._totals[name],
+                })
+            return rows
+
+    def clear(self):
+        with self._lock:
+            self._durations.clear()
+            self._totals.clear()
+
+def _percentile(ordered, q):
+    # Nearest-rank percentile of an already sorted, non-empty list
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+stage_stats = StageStats()
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times one stage; nested spans share the trace and point at their parent.
+    Yields the Span so callers can set() attributes on it.
+    """
+    current = Span(name, parent=_current_span.get(), attributes=attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except GeneratorExit:
+        # A streaming generator closed early is not an error
+        raise
+    except BaseException as e:
+        current.status = "ERROR"
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Finished in another context (e.g. a generator resumed by a different caller)
+            _current_span.set(current.parent)
+        stage_stats.add(current)
+        if TRACE_LOG_ENABLED and logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(current.to_dict(), default=str))
+
+def traced(name=None, **attributes):
+    """
+    Decorator form of span(); the stage name defaults to the function name.
+    """
+    def decorate(fn):
+        stage = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage, **attributes):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def record(**counts):
+    """
+    Adds counters (api_calls, prompt_tokens, ...) to the current span and every span enclosing it.
+    A no-op outside any span.
+    """
+    node = _current_span.get()
+    while node is not None:
+        node.add(**counts)
+        node = node.parent
+
+def annotate(**attributes):
+    """
+    Sets descriptive attributes on the current span only (e.g. which retrieval path was taken).
+    """
+    node = _current_span.get()
+    if node is not None:
+        node.set(**attributes)
+
+def in_current_span(fn):
+    """
+    Wraps 'fn' so that, when a thread pool runs it, record() calls inside it reach the
+    caller's current span (context variables are not inherited by worker threads).
+    """
+    parent = _current_span.get()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return wrapper